@@ -19,7 +19,7 @@ def _env_int(key: str, default: int) -> int:
 
 @dataclass
 class Settings:
-    # 推理端點（Qwen2.5，OpenAI 相容；llama-server / Ollama 皆可）
+    # 推理端點（Qwen2.5，OpenAI 相容；llama-server / Ollama 皆可）；多個副本以逗號分隔
     summarize_url: str = field(default_factory=lambda: _env("SUMMARIZE_URL", "http://localhost:11434/v1"))
     model: str = field(default_factory=lambda: _env("SUMMARIZE_MODEL", "qwen3.5:4b"))
 
@@ -34,13 +34,57 @@ class Settings:
     nllb_device: str = field(default_factory=lambda: _env("NLLB_DEVICE", "cpu"))
 
     # 分段
-    max_chunk_chars: int = field(default_factory=lambda: _env_int("MAX_CHUNK_CHARS", 6000))
+    # 每段 token 上限（依字元集估算；CHUNK_TOKENIZER=server 時改用 llama-server /tokenize 精確計數）
+    max_chunk_tokens: int = field(default_factory=lambda: _env_int("MAX_CHUNK_TOKENS", 1500))
+    chunk_tokenizer: str = field(default_factory=lambda: _env("CHUNK_TOKENIZER", "estimate"))
+    # 全局彙整單次輸入上限（字元）；各段摘要合計超過時先分批濃縮再彙整
+    global_input_chars: int = field(default_factory=lambda: _env_int("GLOBAL_INPUT_CHARS", 6000))
+
+    # 推理端點連線池：所有任務與健康檢查共用同一組 keep-alive 連線
+    llm_timeout: int = field(default_factory=lambda: _env_int("LLM_TIMEOUT", 600))
+    llm_max_connections: int = field(default_factory=lambda: _env_int("LLM_MAX_CONNECTIONS", 32))
+    llm_max_keepalive: int = field(default_factory=lambda: _env_int("LLM_MAX_KEEPALIVE", 16))
+    llm_keepalive_expiry: int = field(default_factory=lambda: _env_int("LLM_KEEPALIVE_EXPIRY", 120))
+    # 多端點：故障（逾時/連線失敗/5xx）時換副本重試的次數，與故障端點暫停分派的秒數
+    llm_retries: int = field(default_factory=lambda: _env_int("LLM_RETRIES", 2))
+    llm_eject_seconds: int = field(default_factory=lambda: _env_int("LLM_EJECT_SECONDS", 30))
+    # llama-server 平行槽數（--parallel）；>0 時摘要/翻譯請求各用一組槽（id_slot，組內輪流），
+    # 同槽連續請求共用系統提示前綴的 KV cache。0 = 交給 server 自行分派
+    llm_slots: int = field(default_factory=lambda: _env_int("LLM_SLOTS", 0))
+
+    # 併發：同時送往推理端點的逐段請求數（對齊 llama-server --parallel / OLLAMA_NUM_PARALLEL 槽數）
+    pipeline_concurrency: int = field(default_factory=lambda: _env_int("PIPELINE_CONCURRENCY", 4))
+    # Qwen 翻譯：同一份文件同時在途的翻譯窗口上限（段內各窗口平行送出）
+    translate_concurrency: int = field(default_factory=lambda: _env_int("TRANSLATE_CONCURRENCY", 4))
+
+    # PDF 擷取/OCR 的工作行程數（大檔依頁範圍分給多個行程）；1 = 單行程逐頁處理
+    extract_workers: int = field(default_factory=lambda: _env_int(
+        "EXTRACT_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+
+    # 排程：同時執行的文件數（其餘排隊）；小於此大小（MB）的檔案優先處理
+    job_workers: int = field(default_factory=lambda: _env_int("JOB_WORKERS", 2))
+    small_doc_mb: int = field(default_factory=lambda: _env_int("SMALL_DOC_MB", 2))
 
     # 服務
     allowed_origins: str = field(default_factory=lambda: _env("ALLOWED_ORIGINS", "*"))
     max_body_mb: int = field(default_factory=lambda: _env_int("MAX_BODY_MB", 50))
     storage_dir: Path = field(default_factory=lambda: Path(_env("STORAGE_DIR", "storage")))
 
+    # 儲存回收：結果快取上限（0 = 不限），依最近使用（LRU）淘汰；存活天數以建立時間計
+    result_cache_max_mb: int = field(default_factory=lambda: _env_int("RESULT_CACHE_MAX_MB", 1024))
+    result_cache_max_entries: int = field(default_factory=lambda: _env_int("RESULT_CACHE_MAX_ENTRIES", 0))
+    result_cache_ttl_days: int = field(default_factory=lambda: _env_int("RESULT_CACHE_TTL_DAYS", 30))
+    # LLM 呼叫快取、逐頁擷取/OCR 快取的筆數上限與存活天數（0 = 不限），超出時刪最舊的
+    llm_cache_max_entries: int = field(default_factory=lambda: _env_int("LLM_CACHE_MAX_ENTRIES", 100000))
+    llm_cache_ttl_days: int = field(default_factory=lambda: _env_int("LLM_CACHE_TTL_DAYS", 30))
+    page_cache_max_entries: int = field(default_factory=lambda: _env_int("PAGE_CACHE_MAX_ENTRIES", 200000))
+    page_cache_ttl_days: int = field(default_factory=lambda: _env_int("PAGE_CACHE_TTL_DAYS", 30))
+    # 分析完的上傳 PDF 保留時數；可續傳上傳的工作階段閒置多久後丟棄
+    upload_retention_hours: int = field(default_factory=lambda: _env_int("UPLOAD_RETENTION_HOURS", 24))
+    upload_session_hours: int = field(default_factory=lambda: _env_int("UPLOAD_SESSION_HOURS", 48))
+    # 背景回收的執行間隔（秒）；0 = 不啟動
+    sweep_interval: int = field(default_factory=lambda: _env_int("SWEEP_INTERVAL", 900))
+
     @property
     def font_path(self) -> str:
         """Noto Sans TC 字型（文字雲與 PDF 報告的中文顯示用）。"""
@@ -57,6 +101,26 @@ class Settings:
         # 掃描版/圖片型 PDF 抽不到文字時，用 RapidOCR fallback（可用 DISABLE_OCR=1 關閉）
         return os.environ.get("DISABLE_OCR") != "1"
 
+    @property
+    def cache_prompt(self) -> bool:
+        # 請 llama-server 重用共同前綴的 KV cache（cache_prompt），可用 DISABLE_CACHE_PROMPT=1 關閉
+        return os.environ.get("DISABLE_CACHE_PROMPT") != "1"
+
+    @property
+    def repeat_guard(self) -> bool:
+        # 生成出現重複迴圈時提前中斷（chat 一律走串流），可用 DISABLE_REPEAT_GUARD=1 關閉
+        return os.environ.get("DISABLE_REPEAT_GUARD") != "1"
+
+    @property
+    def combine_summary_translate(self) -> bool:
+        # 同時要摘要與 Qwen 翻譯時，每窗口一次請求同時回譯文與重點（原文只 prefill 一次）
+        return os.environ.get("COMBINE_SUMMARY_TRANSLATE") == "1"
+
+    @property
+    def enable_llm_cache(self) -> bool:
+        # 逐次 LLM 呼叫的內容定址快取（storage/llm_cache.db），可用 DISABLE_LLM_CACHE=1 關閉
+        return os.environ.get("DISABLE_LLM_CACHE") != "1"
+
     @property
     def origins_list(self) -> list[str]:
         return [o.strip() for o in self.allowed_origins.split(",") if o.strip()]
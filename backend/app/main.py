@@ -1,13 +1,28 @@
 """FastAPI 應用入口 — PDF 摘要+翻譯 gateway（完全本地、無 API Key）。"""
 from __future__ import annotations
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from .core.config import settings
-from .routes import documents, health
+from .routes import documents, health, uploads
+from .services.llm import close_llm_clients
+from .services.sweeper import get_sweeper
+from .services.textproc import close_extract_pool
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    get_sweeper().start()  # 定期回收結果快取、上傳檔與報告（SWEEP_INTERVAL=0 時不啟動）
+    yield
+    get_sweeper().stop()
+    close_llm_clients()  # 釋放共用的推理端點連線池
+    close_extract_pool()
+
 
-app = FastAPI(title="AutoNote PDF 摘要+翻譯 Gateway", version="2.0.0")
+app = FastAPI(title="AutoNote PDF 摘要+翻譯 Gateway", version="2.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,6 +34,7 @@ app.add_middleware(
 
 app.include_router(health.router)
 app.include_router(documents.router)
+app.include_router(uploads.router)
 
 
 @app.get("/")
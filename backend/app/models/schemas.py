@@ -33,11 +33,35 @@ class DocumentSummary(BaseModel):
     error: Optional[str] = None
 
 
+class DocumentLookup(BaseModel):
+    sha256: str               # PDF 內容的 SHA-256（hex）
+    filename: str = "document.pdf"
+    features: str = "summary,translate,wordcloud,report"
+
+
+class LookupResult(BaseModel):
+    doc_id: Optional[str] = None    # 命中快取時的新 doc_id，可直接 GET /documents/{id}/result
+    upload_required: bool = True    # 未命中：請改走 POST /documents 或 /uploads 上傳檔案
+
+
+class UploadCreate(BaseModel):
+    filename: str
+    size: int                 # 檔案總位元組數
+
+
+class UploadStatus(BaseModel):
+    upload_id: str
+    filename: str
+    size: int
+    offset: int               # 伺服器已收的位元組數；續傳從這裡接著送
+
+
 class StatusResponse(BaseModel):
     status: JobStatus
     progress: int = 0
     message: str = ""
     error: Optional[str] = None
+    queue_position: Optional[int] = None  # 排隊中時的名次（1 = 下一個）
 
 
 class Segment(BaseModel):
@@ -66,8 +90,27 @@ class ResultResponse(BaseModel):
     report_pdf_url: Optional[str] = None        # Phase 4
 
 
+class ResultMeta(BaseModel):
+    """結果的頂層欄位（不含段落內容）；段落另以 /segments 分頁取得。"""
+    doc_id: str
+    language: str = "en"
+    total_pages: int = 0
+    segment_count: int = 0
+    global_summary: Optional[GlobalSummary] = None
+    keywords: list[str] = []
+    wordcloud_image_url: Optional[str] = None
+    report_pdf_url: Optional[str] = None
+
+
+class SegmentPage(BaseModel):
+    doc_id: str
+    total: int                          # 段落總數
+    offset: int
+    segments: list[dict[str, Any]] = []  # 依 fields 投影後的段落（index 一律附上）
+
+
 class ProgressEvent(BaseModel):
-    type: str  # "progress" | "result" | "error"
+    type: str  # "progress" | "result" | "error" | "delta"
     progress: int = 0
     message: str = ""
     data: Optional[Any] = None
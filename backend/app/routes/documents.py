@@ -1,95 +1,136 @@
 """文件 API：上傳 → (串流 | 非同步輪詢) → 結果；歷史列表 / 查看 / 刪除。"""
 from __future__ import annotations
 
-import hashlib
 import json
 from pathlib import Path
 
 from fastapi import APIRouter, File, Form, HTTPException, Query, UploadFile
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 
 from ..core.config import settings
-from ..models.schemas import DocumentCreated, DocumentSummary, ResultResponse, StatusResponse
+from ..models.schemas import (
+    DocumentCreated,
+    DocumentLookup,
+    DocumentSummary,
+    LookupResult,
+    ResultMeta,
+    ResultResponse,
+    SegmentPage,
+    StatusResponse,
+)
+from ..services.blobs import get_blobs
 from ..services.cache import get_cache
-from ..services.jobs import manager
-from ..services.pipeline import run_pipeline
+from ..services.jobs import PRIORITY_INTERACTIVE, manager
 from ..services.store import get_store
+from ..services.uploads import UploadError, store_stream
+
+try:
+    import orjson  # 可選：NDJSON 事件改用 orjson 序列化（未安裝時用標準 json）
+except ImportError:
+    orjson = None
 
 router = APIRouter()
 
 
+def _ndjson(event: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(event) + b"\n"
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _result_line(event: dict, body: bytes) -> bytes:
+    """result 事件：data 直接嵌入存好的結果 JSON bytes，不再對整份結果重新序列化。"""
+    head = _ndjson({k: v for k, v in event.items() if k != "data"}).rstrip()
+    return head[:-1] + b',"data":' + body + b"}\n"
+
+
 def _save_upload(file: UploadFile) -> tuple[str, Path]:
-    raw = file.file.read()
-    if not raw:
-        raise HTTPException(400, "空檔案")
-    if len(raw) > settings.max_body_mb * 1024 * 1024:
-        raise HTTPException(413, f"檔案超過 {settings.max_body_mb}MB 上限")
+    """逐塊寫入 uploads/{digest}.pdf，邊收邊算 hash、超過上限立即中止（每個並行上傳只佔一塊記憶體）。"""
     if not (file.filename or "").lower().endswith(".pdf"):
         raise HTTPException(415, "僅支援 PDF")
+    try:
+        return store_stream(file.file.read, settings.storage_dir / "uploads",
+                            settings.max_body_mb * 1024 * 1024)
+    except UploadError as e:
+        raise HTTPException(e.status, str(e)) from None
 
-    digest = hashlib.sha256(raw).hexdigest()[:16]
-    upload_dir = settings.storage_dir / "uploads"
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    path = upload_dir / f"{digest}.pdf"
-    path.write_bytes(raw)
-    return digest, path
 
+def _seed_hit(ref: str, meta: dict, filename: str):
+    """快取命中：建立已完成的 job 與歷史紀錄，與快取共用同一份結果 blob（只讀頂層欄位，不解壓段落）。"""
+    job = manager.seed_done()
+    store = get_store()
+    store.create(job.doc_id, filename)
+    store.finish(job.doc_id, meta, result_hash=ref)
+    return job
 
-@router.post("/documents")
-def create_document(
-    file: UploadFile = File(...),
-    features: str = Form("summary,translate,wordcloud,report"),
-    stream: int = Query(0, description="1=直接回 NDJSON 串流；0=回 doc_id 供輪詢"),
-    refresh: int = Query(0, description="1=略過快取、強制重新分析並覆寫結果"),
-):
+
+def start_analysis(digest: str, path: Path, filename: str, features: str,
+                   stream: int = 0, refresh: int = 0, deltas: int = 0):
+    """已落地的 PDF → 查結果快取或排入分析；回 DocumentCreated 或 NDJSON 串流。
+
+    deltas=1（且 stream=1）時模型改走 SSE、串流中夾帶生成中的 delta 事件；沒人顯示時不開，省下逐 token 的轉送。
+
+    multipart 上傳與可續傳上傳（routes/uploads.py）收齊檔案後都走這裡。
+    """
     do_summary = "summary" in features
     do_translate = "translate" in features
     do_wordcloud = "wordcloud" in features
     do_report = "report" in features
-    filename = file.filename or "document.pdf"
-    digest, path = _save_upload(file)
 
     cache = get_cache()
     store = get_store()
     cache_key = cache.make_key(digest, settings.translator, settings.target_lang, features)
-    cached = None if refresh else cache.get(cache_key)
+    hit = None if refresh else cache.lookup_meta(cache_key)
 
-    if stream:
+    if hit is not None:
+        job = _seed_hit(*hit, filename)
+    else:
         job = manager.create()  # 串流也給 doc_id，供報告下載
         store.create(job.doc_id, filename)
+        # 同內容同變體已在分析時，run_async 會把這個 job 掛到進行中的那份上
+        manager.run_async(job, path, settings, do_summary, do_translate, do_wordcloud, do_report,
+                          cache_key=cache_key, refresh=bool(refresh), stream_deltas=bool(stream and deltas),
+                          priority=PRIORITY_INTERACTIVE if stream else None, digest=digest)
 
+    if stream:
         def gen():
-            if cached is not None:
-                job.result = cached
-                job.status = "done"
-                store.finish(job.doc_id, cached)
-                yield json.dumps({"type": "result", "progress": 100,
-                                  "message": "快取命中", "data": cached}, ensure_ascii=False) + "\n"
-                return
-            for event in run_pipeline(path, settings, do_summary, do_translate,
-                                      do_wordcloud, do_report, doc_id=job.doc_id):
-                if event["type"] == "result" and event.get("data") is not None:
-                    job.result = event["data"]
-                    job.status = "done"
-                    cache.put(cache_key, job.result)
-                    store.finish(job.doc_id, job.result)
-                elif event["type"] == "error":
-                    store.fail(job.doc_id, event.get("message", "error"))
-                yield json.dumps(event, ensure_ascii=False) + "\n"
+            for event in manager.events(job):
+                if event["type"] == "result":
+                    rec = store.get(job.doc_id, with_result=False) or {}
+                    body = rec.get("result_hash") and get_blobs().get_json(rec["result_hash"], job.doc_id)
+                    if body:
+                        yield _result_line(event, body)
+                        continue
+                yield _ndjson(event)
 
         return StreamingResponse(gen(), media_type="application/x-ndjson")
+    return DocumentCreated(doc_id=job.doc_id)
 
-    if cached is not None:
-        job = manager.seed_done(cached)
-        store.create(job.doc_id, filename)
-        store.finish(job.doc_id, cached)
-        return DocumentCreated(doc_id=job.doc_id)
 
-    job = manager.create()
-    store.create(job.doc_id, filename)
-    manager.run_async(job, path, settings, do_summary, do_translate,
-                      do_wordcloud, do_report, cache_key=cache_key)
-    return DocumentCreated(doc_id=job.doc_id)
+@router.post("/documents")
+def create_document(
+    file: UploadFile = File(...),
+    features: str = Form("summary,translate,wordcloud,report"),
+    stream: int = Query(0, description="1=直接回 NDJSON 串流；0=回 doc_id 供輪詢"),
+    refresh: int = Query(0, description="1=略過快取、強制重新分析並覆寫結果"),
+    deltas: int = Query(0, description="1=串流時另送生成中的 delta 事件（需 stream=1）"),
+):
+    digest, path = _save_upload(file)
+    return start_analysis(digest, path, file.filename or "document.pdf", features, stream, refresh, deltas)
+
+
+@router.post("/documents/lookup", response_model=LookupResult)
+def lookup_document(body: DocumentLookup):
+    """先送 hash 再決定要不要上傳：同內容同變體已有結果時直接建立一筆歷史並回 doc_id，免傳檔。"""
+    sha = body.sha256.strip().lower()
+    if len(sha) != 64 or any(c not in "0123456789abcdef" for c in sha):
+        raise HTTPException(400, "sha256 須為 64 位十六進位字串")
+    key = get_cache().make_key(sha[:16], settings.translator, settings.target_lang, body.features)
+    hit = get_cache().lookup_meta(key)
+    if hit is None:
+        return LookupResult()
+    job = _seed_hit(*hit, body.filename)
+    return LookupResult(doc_id=job.doc_id, upload_required=False)
 
 
 @router.get("/documents", response_model=list[DocumentSummary])
@@ -102,9 +143,11 @@ def list_documents():
 def get_status(doc_id: str):
     job = manager.get(doc_id)
     if job:  # 進行中或本次 session 的即時狀態
+        pos = manager.position(job) if job.status == "queued" else None
+        message = f"排隊中（第 {pos} 位）" if pos else job.message
         return StatusResponse(status=job.status, progress=job.progress,
-                              message=job.message, error=job.error)
-    rec = get_store().get(doc_id)  # 過去的（含重啟後）
+                              message=message, error=job.error, queue_position=pos)
+    rec = get_store().get(doc_id, with_result=False)  # 過去的（含重啟後）；只需狀態，不解壓結果
     if not rec:
         raise HTTPException(404, "查無此 doc_id")
     prog = 100 if rec["status"] == "done" else 0
@@ -112,19 +155,58 @@ def get_status(doc_id: str):
                           message=rec["status"], error=rec.get("error"))
 
 
-@router.get("/documents/{doc_id}/result", response_model=ResultResponse)
-def get_result(doc_id: str):
-    job = manager.get(doc_id)
-    if job and job.result is not None:
-        return ResultResponse(doc_id=doc_id, **job.result)
-    rec = get_store().get(doc_id)  # 從持久化歷史讀
+def _result_ref(doc_id: str) -> str:
+    """已完成文件的結果 blob hash（不載入結果本體）。"""
+    rec = get_store().get(doc_id, with_result=False)
     if not rec:
         raise HTTPException(404, "查無此 doc_id")
     if rec["status"] == "error":
         raise HTTPException(500, rec.get("error") or "處理失敗")
-    if rec["status"] != "done" or not rec.get("result"):
+    if rec["status"] != "done" or not rec.get("result_hash"):
         raise HTTPException(409, f"尚未完成（status={rec['status']}）")
-    return ResultResponse(doc_id=doc_id, **rec["result"])
+    return rec["result_hash"]
+
+
+@router.get("/documents/{doc_id}/result", response_model=ResultResponse)
+def get_result(doc_id: str):
+    """直接回傳存好的 JSON bytes（寫入時已依 ResultResponse 驗證），不再 parse → 驗證 → 重新 encode。"""
+    body = get_blobs().get_json(_result_ref(doc_id), doc_id)
+    if body is None:
+        raise HTTPException(404, "結果已不存在")
+    return Response(body, media_type="application/json")
+
+
+_SEGMENT_FIELDS = {"original", "summary", "translated"}
+
+
+@router.get("/documents/{doc_id}/meta", response_model=ResultMeta)
+def get_meta(doc_id: str):
+    """結果的頂層欄位 + 段落數，不含任何段落內容。"""
+    meta = get_blobs().get_meta(_result_ref(doc_id))
+    if meta is None:
+        raise HTTPException(404, "結果已不存在")
+    return ResultMeta(doc_id=doc_id, **meta)
+
+
+@router.get("/documents/{doc_id}/segments", response_model=SegmentPage)
+def get_segments(
+    doc_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=200),
+    fields: str = Query("original,summary,translated",
+                        description="逗號分隔的欄位投影，例如 summary 只取摘要"),
+):
+    """分頁取段落：只解壓這一頁的段落；fields 投影只縮小回應（每段仍整段解壓，見 BlobStore.get_segments）。"""
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    if not wanted or not wanted <= _SEGMENT_FIELDS:
+        raise HTTPException(400, f"fields 只能是 {','.join(sorted(_SEGMENT_FIELDS))} 的組合")
+    ref = _result_ref(doc_id)
+    blobs = get_blobs()
+    total = blobs.segment_count(ref)
+    if total is None:
+        raise HTTPException(404, "結果已不存在")
+    return SegmentPage(doc_id=doc_id, total=total, offset=offset,
+                       segments=blobs.get_segments(ref, offset, limit, wanted))
 
 
 @router.get("/documents/{doc_id}/report.pdf")
@@ -4,7 +4,10 @@ from __future__ import annotations
 from fastapi import APIRouter
 
 from ..core.config import settings
-from ..services.llm import LLMClient
+from ..services.cache import get_cache
+from ..services.jobs import manager
+from ..services.llm import get_llm
+from ..services.sweeper import get_sweeper
 
 router = APIRouter()
 
@@ -12,10 +15,15 @@ router = APIRouter()
 @router.get("/healthz")
 def healthz():
     status = {"service": "ok", "summarize_endpoint": settings.summarize_url}
+    llm = get_llm()
     try:
-        models = LLMClient(settings.summarize_url, settings.model).ping()
+        models = llm.ping()
         status["summarize"] = "ok"
         status["models"] = models
     except Exception as e:  # noqa: BLE001
         status["summarize"] = f"unreachable: {e}"
+    status["endpoints"] = llm.stats()  # 各副本健康狀態、在途請求數與平均延遲
+    status["result_cache"] = get_cache().stats()   # 筆數、位元組、命中/未命中/淘汰次數
+    status["sweeper"] = get_sweeper().stats()
+    status["jobs"] = {"last_error": manager.last_error}   # 背景任務最近一次未預期的錯誤
     return status
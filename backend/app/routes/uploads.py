@@ -0,0 +1,103 @@
+"""可續傳上傳 API：大型 PDF 分段上傳，中斷後從已收位移續傳，收齊後接上一般的分析流程。
+
+    POST   /uploads                 建立工作階段（filename、size）→ upload_id
+    PUT    /uploads/{id}            送一段位元組，標頭 Content-Range: bytes start-end/total
+    GET    /uploads/{id}            查詢已收位移
+    POST   /uploads/{id}/complete   收齊後開始分析（參數同 POST /documents）
+    DELETE /uploads/{id}            放棄上傳
+"""
+from __future__ import annotations
+
+import re
+
+from fastapi import APIRouter, Form, Header, HTTPException, Query, Request
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+
+from ..core.config import settings
+from ..models.schemas import UploadCreate, UploadStatus
+from ..services.uploads import UploadError, UploadSession, get_uploads
+from .documents import start_analysis
+
+router = APIRouter()
+
+_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+def _status(sess: UploadSession) -> UploadStatus:
+    return UploadStatus(upload_id=sess.upload_id, filename=sess.filename,
+                        size=sess.size, offset=sess.offset)
+
+
+def _session(upload_id: str) -> UploadSession:
+    sess = get_uploads().get(upload_id)
+    if sess is None:
+        raise HTTPException(404, "查無此上傳")
+    return sess
+
+
+@router.post("/uploads", response_model=UploadStatus)
+def create_upload(body: UploadCreate):
+    if not body.filename.lower().endswith(".pdf"):
+        raise HTTPException(415, "僅支援 PDF")
+    if body.size <= 0:
+        raise HTTPException(400, "空檔案")
+    if body.size > settings.max_body_mb * 1024 * 1024:
+        raise HTTPException(413, f"檔案超過 {settings.max_body_mb}MB 上限")
+    return _status(get_uploads().create(body.filename, body.size))
+
+
+@router.get("/uploads/{upload_id}", response_model=UploadStatus)
+def get_upload(upload_id: str):
+    return _status(_session(upload_id))
+
+
+@router.put("/uploads/{upload_id}", response_model=UploadStatus)
+async def put_upload(upload_id: str, request: Request,
+                     content_range: str = Header(..., description="bytes start-end/total")):
+    """接收一段內容，邊收邊寫入並累算 hash（不整段留在記憶體）。
+
+    寫檔與 hash（以及重啟後重建工作階段的重算）都丟到執行緒池，不卡住事件迴圈。
+    連線中途斷掉時已收到的部分保留，客戶端 GET 查位移後從那裡續傳；
+    內容長度與 Content-Range 不符時整段作廢（400）。
+    """
+    sess = await run_in_threadpool(_session, upload_id)
+    m = _RANGE.match(content_range.strip())
+    if not m or int(m[3]) != sess.size or int(m[1]) > int(m[2]):
+        raise HTTPException(416, f"Content-Range 格式應為 bytes start-end/{sess.size}")
+    start, length = int(m[1]), int(m[2]) - int(m[1]) + 1
+    try:
+        with get_uploads().append(sess, start, length) as write:
+            async for block in request.stream():
+                if block:
+                    await run_in_threadpool(write, block)
+            if sess.offset != start + length:
+                raise UploadError(400, f"收到 {sess.offset - start} bytes，與 Content-Range 宣告的 {length} bytes 不符")
+    except UploadError as e:
+        raise HTTPException(e.status, str(e)) from None
+    except ClientDisconnect:
+        pass  # 已寫入的部分算數，等客戶端續傳
+    return _status(sess)
+
+
+@router.post("/uploads/{upload_id}/complete")
+def complete_upload(
+    upload_id: str,
+    features: str = Form("summary,translate,wordcloud,report"),
+    stream: int = Query(0, description="1=直接回 NDJSON 串流；0=回 doc_id 供輪詢"),
+    refresh: int = Query(0, description="1=略過快取、強制重新分析並覆寫結果"),
+    deltas: int = Query(0, description="1=串流時另送生成中的 delta 事件（需 stream=1）"),
+):
+    sess = _session(upload_id)
+    try:
+        digest, path = get_uploads().finalize(sess)
+    except UploadError as e:
+        raise HTTPException(e.status, str(e)) from None
+    return start_analysis(digest, path, sess.filename, features, stream, refresh, deltas)
+
+
+@router.delete("/uploads/{upload_id}")
+def delete_upload(upload_id: str):
+    sess = _session(upload_id)
+    get_uploads().discard(sess.upload_id)
+    return {"deleted": upload_id}
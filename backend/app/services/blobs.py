@@ -0,0 +1,202 @@
+"""分析結果的內容定址儲存（storage/results.db）。
+
+一份結果（全部段落的原文/譯文/摘要 + base64 文字雲）只壓縮存一次，key 為序列化 JSON 的 sha256；
+結果快取（cache.db）與歷史紀錄（documents.db）的列都只存這個 hash。
+
+段落另外正規化成 segments 表（每段一列、各自壓縮的 JSON），blobs 列只存其餘的頂層欄位：
+分頁讀取只解壓需要的那幾段，取 metadata 完全不碰段落內容。
+存的是序列化好的 JSON bytes：完整結果回應（get_json）只需解壓後拼接，不必 parse 再 encode。
+壓縮預設 zlib；有安裝 zstandard 時改用 zstd（較快、壓縮率也較好）。每筆記錄自己的 codec，讀取不受環境影響。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+
+from .db import connect
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def encode_result(result) -> bytes:
+    """結果的標準序列化（UTF-8 JSON）；hash 與儲存都以此為準。"""
+    return json.dumps(result, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _compress(raw: bytes) -> tuple[str, bytes]:
+    zstd = _zstd()
+    if zstd is not None:
+        return "zstd", zstd.ZstdCompressor(level=6).compress(raw)
+    return "zlib", zlib.compress(raw, 6)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        zstd = _zstd()
+        if zstd is None:
+            raise RuntimeError("此結果以 zstd 壓縮，需安裝 zstandard 才能讀取")
+        return zstd.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    return data
+
+
+class BlobStore:
+    def __init__(self, db_path: str | Path):
+        self.db_path = str(db_path)
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._init()
+
+    def _conn(self) -> sqlite3.Connection:
+        return connect(self.db_path)
+
+    def _init(self) -> None:
+        with self._conn() as c:
+            # n_segments 為 NULL 的是舊版整份存放的列（data 含 segments），啟動時轉成分表
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "hash TEXT PRIMARY KEY, codec TEXT NOT NULL, data BLOB NOT NULL, "
+                "raw_size INTEGER NOT NULL, created_at REAL NOT NULL, n_segments INTEGER)"
+            )
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS segments ("
+                "hash TEXT NOT NULL, idx INTEGER NOT NULL, codec TEXT NOT NULL, data BLOB NOT NULL, "
+                "PRIMARY KEY(hash, idx)) WITHOUT ROWID"
+            )
+            cols = {r[1] for r in c.execute("PRAGMA table_info(blobs)")}
+            if "n_segments" not in cols:
+                c.execute("ALTER TABLE blobs ADD COLUMN n_segments INTEGER")
+            legacy = c.execute(
+                "SELECT hash, codec, data, raw_size FROM blobs WHERE n_segments IS NULL"
+            ).fetchall()
+            for digest, codec, data, raw_size in legacy:
+                c.execute("DELETE FROM blobs WHERE hash=?", (digest,))
+                self._insert(c, digest, json.loads(_decompress(codec, data)), raw_size)
+
+    @staticmethod
+    def _insert(c: sqlite3.Connection, digest: str, result: dict, raw_size: int) -> None:
+        segments = result.get("segments") or []
+        head = {k: v for k, v in result.items() if k != "segments"}
+        codec, data = _compress(encode_result(head))
+        c.execute(
+            "INSERT OR IGNORE INTO blobs(hash, codec, data, raw_size, created_at, n_segments) "
+            "VALUES (?,?,?,?,?,?)",
+            (digest, codec, data, raw_size, time.time(), len(segments)),
+        )
+        c.executemany(
+            "INSERT OR IGNORE INTO segments(hash, idx, codec, data) VALUES (?,?,?,?)",
+            [(digest, i, *_compress(encode_result(seg))) for i, seg in enumerate(segments)],
+        )
+
+    def put(self, result: dict) -> str:
+        """存入結果並回傳其 hash；同內容已存在時不重寫，只更新 created_at。
+
+        更新時間讓剛被重新引用的既有結果落在 prune() 的寬限期內，不會在寫進快取/歷史前被回收。
+        """
+        raw = encode_result(result)
+        digest = hashlib.sha256(raw).hexdigest()
+        with self._conn() as c:
+            if not c.execute("UPDATE blobs SET created_at=? WHERE hash=?",
+                             (time.time(), digest)).rowcount:
+                self._insert(c, digest, result, len(raw))
+        return digest
+
+    def stored_size(self, digest: str) -> int:
+        """這份結果壓縮後實際佔用的位元組數（頂層欄位 + 全部段落）。"""
+        with self._conn() as c:
+            head = c.execute("SELECT length(data) FROM blobs WHERE hash=?", (digest,)).fetchone()
+            segs = c.execute(
+                "SELECT COALESCE(SUM(length(data)), 0) FROM segments WHERE hash=?", (digest,)
+            ).fetchone()
+        return (head[0] if head else 0) + segs[0]
+
+    def prune(self, keep: set[str], older_than: float) -> int:
+        """刪除 keep 以外、建立時間早於 older_than 的結果（含其段落），回傳刪除份數。
+
+        older_than 留一段寬限：剛寫入 blob、還沒寫進快取/歷史紀錄的結果不會被誤刪。
+        """
+        with self._conn() as c:
+            rows = c.execute("SELECT hash FROM blobs WHERE created_at < ?", (older_than,)).fetchall()
+            doomed = [(r[0],) for r in rows if r[0] not in keep]
+            c.executemany("DELETE FROM segments WHERE hash=?", doomed)
+            c.executemany("DELETE FROM blobs WHERE hash=?", doomed)
+        return len(doomed)
+
+    def get_meta(self, digest: str) -> dict | None:
+        """頂層欄位（不含 segments），另加 segment_count。"""
+        with self._conn() as c:
+            row = c.execute(
+                "SELECT codec, data, n_segments FROM blobs WHERE hash=?", (digest,)
+            ).fetchone()
+        if not row:
+            return None
+        meta = json.loads(_decompress(row[0], row[1]))
+        meta["segment_count"] = int(row[2] or 0)
+        return meta
+
+    def segment_count(self, digest: str) -> int | None:
+        with self._conn() as c:
+            row = c.execute("SELECT n_segments FROM blobs WHERE hash=?", (digest,)).fetchone()
+        return int(row[0] or 0) if row else None
+
+    def get_segments(self, digest: str, offset: int = 0, limit: int | None = None,
+                     fields: set[str] | None = None) -> list[dict]:
+        """依序取 [offset, offset+limit) 的段落；fields 指定時只回這些欄位（index 一律附上）。
+
+        每段是整段壓縮成一列存放：分頁省下的是其他段的解壓，fields 投影只縮小回應大小，
+        取出的段落仍整段解壓。
+        """
+        with self._conn() as c:
+            rows = c.execute(
+                "SELECT codec, data FROM segments WHERE hash=? AND idx>=? ORDER BY idx LIMIT ?",
+                (digest, offset, -1 if limit is None else limit),
+            ).fetchall()
+        out = [json.loads(_decompress(codec, data)) for codec, data in rows]
+        if fields:
+            out = [{k: v for k, v in seg.items() if k == "index" or k in fields} for seg in out]
+        return out
+
+    def get_json(self, digest: str, doc_id: str) -> bytes | None:
+        """完整結果的 JSON bytes（開頭注入 doc_id），直接由存好的片段拼接而成。"""
+        with self._conn() as c:
+            row = c.execute("SELECT codec, data FROM blobs WHERE hash=?", (digest,)).fetchone()
+            if not row:
+                return None
+            segs = c.execute(
+                "SELECT codec, data FROM segments WHERE hash=? ORDER BY idx", (digest,)
+            ).fetchall()
+        head = _decompress(row[0], row[1])[1:-1]   # 去掉外層 {}
+        parts = [b'"doc_id":' + encode_result(doc_id)]
+        if head:
+            parts.append(head)
+        parts.append(b'"segments":[' + b",".join(_decompress(cd, d) for cd, d in segs) + b"]")
+        return b"{" + b",".join(parts) + b"}"
+
+    def get(self, digest: str) -> dict | None:
+        meta = self.get_meta(digest)
+        if meta is None:
+            return None
+        meta.pop("segment_count")
+        return {**meta, "segments": self.get_segments(digest)}
+
+
+_blobs: BlobStore | None = None
+
+
+def get_blobs() -> BlobStore:
+    global _blobs
+    if _blobs is None:
+        from ..core.config import settings
+
+        _blobs = BlobStore(settings.storage_dir / "results.db")
+    return _blobs
@@ -0,0 +1,90 @@
+"""生成長度預算：依輸入 token 估算與實測的「輸出/輸入」比例決定每次請求的 max_tokens。
+
+固定給大額度（摘要 900、翻譯 len+500）會讓偶發的失控生成（複誦原文、重複迴圈）一路燒到上限；
+改成依輸入大小 × 該任務/語言實測比例 × 安全係數，正常輸出不受影響，失控時早早被截斷。
+比例以指數移動平均從過去的 ChatResult.completion_tokens 學習（行程內，重啟後從預設值重來）。
+因長度被截斷（finish_reason=length）的輸出以 max_tokens 當作比例的下限樣本，並由 generate()
+依階梯調高預算重試，不讓過小的預算自我強化。
+"""
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+from typing import Callable
+
+from .llm import ChatResult
+
+# 各任務的預設 輸出/輸入 token 比例（尚無觀測時使用）與上限
+_DEFAULT_RATIO = {"summary": 0.4, "translate": 1.6, "combined": 2.0}
+_CAP = {"summary": 900, "translate": 2048, "combined": 2560}
+# 預算取整到固定階梯：比例小幅漂移時 max_tokens 不變，逐次呼叫快取的 key 才穩定
+_LADDER = [192, 256, 384, 512, 768, 1024, 1536, 2048, 2560]
+
+
+class TokenBudget:
+    def __init__(self, margin: float = 1.5, floor: int = 128, alpha: float = 0.2):
+        self.margin = margin      # 安全係數：預算 = 輸入 × 比例 × margin + floor
+        self.floor = floor
+        self.alpha = alpha        # EWMA 權重
+        self._ratio: dict[tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def ratio(self, task: str, lang: str) -> float:
+        with self._lock:
+            return self._ratio.get((task, lang), _DEFAULT_RATIO.get(task, 1.0))
+
+    def max_tokens(self, task: str, lang: str, in_tokens: int) -> int:
+        want = math.ceil(in_tokens * self.ratio(task, lang) * self.margin) + self.floor
+        cap = _CAP.get(task, _LADDER[-1])
+        k = bisect.bisect_left(_LADDER, want)
+        return min(cap, _LADDER[k] if k < len(_LADDER) else cap)
+
+    def next_step(self, task: str, max_tokens: int) -> int | None:
+        """比 max_tokens 大的下一階預算；已到該任務上限時回 None。"""
+        cap = _CAP.get(task, _LADDER[-1])
+        k = bisect.bisect_right(_LADDER, max_tokens)
+        bigger = min(cap, _LADDER[k] if k < len(_LADDER) else cap)
+        return bigger if bigger > max_tokens else None
+
+    def observe(self, task: str, lang: str, in_tokens: int, res: ChatResult, max_tokens: int) -> None:
+        """記錄一次實測輸出。快取命中、被判定失控的結果不列入；
+        頂到上限（實際長度未知）的結果以 max_tokens 作為下限樣本，讓比例往上修。"""
+        if res.cached or res.degenerate or in_tokens <= 0 or not res.completion_tokens:
+            return
+        used = res.completion_tokens
+        if res.truncated or used >= max_tokens:
+            used = max(used, max_tokens)
+        r = used / in_tokens
+        with self._lock:
+            key = (task, lang)
+            old = self._ratio.get(key)
+            self._ratio[key] = r if old is None else (1 - self.alpha) * old + self.alpha * r
+
+    def generate(self, task: str, lang: str, in_tokens: int,
+                 chat: Callable[[int, Callable[[str], None] | None], ChatResult],
+                 on_delta: Callable[[str], None] | None = None,
+                 max_tokens: int | None = None) -> ChatResult:
+        """以預算呼叫 chat(max_tokens, on_delta) 並記錄實測；輸出被截斷時調高一階重試直到上限。
+
+        重試不再串流 delta（已送出的片段收不回來），最終內容以回傳結果為準。
+        """
+        if max_tokens is None:
+            max_tokens = self.max_tokens(task, lang, in_tokens)
+        res = chat(max_tokens, on_delta)
+        self.observe(task, lang, in_tokens, res, max_tokens)
+        while res.truncated and (bigger := self.next_step(task, max_tokens)):
+            max_tokens = bigger
+            res = chat(max_tokens, None)
+            self.observe(task, lang, in_tokens, res, max_tokens)
+        return res
+
+
+_budget: TokenBudget | None = None
+
+
+def get_budget() -> TokenBudget:
+    global _budget
+    if _budget is None:
+        _budget = TokenBudget()
+    return _budget
@@ -1,51 +1,307 @@
 """結果快取（SQLite，依 PDF hash + 變體去重）。Phase 3。
 
 同一份 PDF 且同樣的翻譯器/語向/功能組合，直接回傳既有結果，免重算。
+結果本體壓縮存在 blobs.py 的內容定址儲存，快取列只記它的 hash（與歷史紀錄共用同一份）。
+另有逐次 LLM 呼叫的內容定址快取（ChatCache）：只要模型與提示完全相同就重用輸出，
+切換功能組合或重傳只改了幾頁的 PDF 時，未變動的段落不必再推理。
+結果快取有上限（總位元組、筆數、存活時間）：每次命中更新 last_access，evict() 依 LRU 淘汰，
+由 sweeper.py 定期呼叫；命中/未命中/淘汰次數另有計數供 /healthz 觀察。
+LLM 呼叫快取與頁面快取則依建立時間淘汰（TTL + 筆數上限，最舊的先刪），同樣由 sweeper 呼叫。
+PageCache 則存逐頁擷取文字（依 PDF hash）與 OCR 輸出（依頁面影像 hash），
+refresh 或換功能組合重跑時不必再 render + OCR；不同 PDF 含相同掃描頁也能共用。
 """
 from __future__ import annotations
 
+import hashlib
 import json
 import sqlite3
+import threading
 import time
 from pathlib import Path
 
+from .blobs import BlobStore, get_blobs
+from .db import connect
+
+
+def _trim(c: sqlite3.Connection, table: str, max_entries: int, ttl: float) -> int:
+    """刪除 table 中建立超過 ttl 秒、以及超出 max_entries 的最舊列（0 = 不限），回傳刪除列數。"""
+    removed = 0
+    if ttl:
+        removed += c.execute(f"DELETE FROM {table} WHERE created_at < ?", (time.time() - ttl,)).rowcount
+    if max_entries:
+        removed += c.execute(
+            f"DELETE FROM {table} WHERE rowid IN "
+            f"(SELECT rowid FROM {table} ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (max_entries,),
+        ).rowcount
+    return removed
+
 
 class ResultCache:
-    def __init__(self, db_path: str | Path):
+    def __init__(self, db_path: str | Path, blobs: BlobStore | None = None):
         self.db_path = str(db_path)
         Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.blobs = blobs or get_blobs()
+        self._counts = {"hits": 0, "misses": 0, "evictions": 0}
+        self._count_lock = threading.Lock()
         self._init()
 
     def _conn(self) -> sqlite3.Connection:
-        # 每次操作開新連線，避免跨執行緒共用問題
-        return sqlite3.connect(self.db_path, timeout=10)
+        return connect(self.db_path)   # 本執行緒共用的長駐連線（WAL），見 db.py
 
     def _init(self) -> None:
         with self._conn() as c:
+            # size = 結果 blob 壓縮後的位元組數（淘汰時計算總量用）；last_access = 最近命中時間（LRU）
             c.execute(
                 "CREATE TABLE IF NOT EXISTS result_cache ("
-                "key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL)"
+                "key TEXT PRIMARY KEY, result TEXT NOT NULL DEFAULT '', result_hash TEXT, "
+                "created_at REAL NOT NULL, last_access REAL, size INTEGER NOT NULL DEFAULT 0)"
             )
+            cols = {r[1] for r in c.execute("PRAGMA table_info(result_cache)")}
+            if "result_hash" not in cols:
+                c.execute("ALTER TABLE result_cache ADD COLUMN result_hash TEXT")
+            if "last_access" not in cols:
+                c.execute("ALTER TABLE result_cache ADD COLUMN last_access REAL")
+            if "size" not in cols:
+                c.execute("ALTER TABLE result_cache ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            c.execute("UPDATE result_cache SET last_access=created_at WHERE last_access IS NULL")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_access ON result_cache(last_access)")
+            # 舊版整份 JSON 存在 result 欄：搬進 blob 儲存、清空原欄位
+            legacy = c.execute(
+                "SELECT key, result FROM result_cache WHERE result_hash IS NULL AND result != ''"
+            ).fetchall()
+            for key, text in legacy:
+                c.execute("UPDATE result_cache SET result='', result_hash=? WHERE key=?",
+                          (self.blobs.put(json.loads(text)), key))
+            unsized = c.execute(
+                "SELECT key, result_hash FROM result_cache WHERE size=0 AND result_hash IS NOT NULL"
+            ).fetchall()
+            for key, ref in unsized:
+                c.execute("UPDATE result_cache SET size=? WHERE key=?",
+                          (self.blobs.stored_size(ref), key))
+        if legacy:  # 搬走大欄位後回收空間（VACUUM 不能在交易內執行）
+            self._conn().execute("VACUUM")
 
     @staticmethod
     def make_key(pdf_hash: str, translator: str, target_lang: str, features: str) -> str:
         feats = ",".join(sorted(f.strip() for f in features.split(",") if f.strip()))
         return f"{pdf_hash}|{translator}|{target_lang}|{feats}"
 
+    def ref(self, key: str) -> str | None:
+        """快取命中時回傳結果的 blob hash（不解壓）。"""
+        with self._conn() as c:
+            row = c.execute("SELECT result_hash FROM result_cache WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, key: str) -> tuple[str, dict] | None:
+        """回傳 (blob hash, 結果)；hash 可直接交給 DocumentStore.finish 共用同一份 blob。
+
+        命中時更新 last_access（LRU 依據）並計入命中數，否則計入未命中數。
+        """
+        ref = self.ref(key)
+        result = self.blobs.get(ref) if ref else None
+        return self._touch(key, ref, result)
+
+    def lookup_meta(self, key: str) -> tuple[str, dict] | None:
+        """同 lookup，但只解壓頂層欄位（BlobStore.get_meta，不含段落）。
+
+        命中後只需建立歷史紀錄（total_pages、report_pdf_url）時用這個，不必把整份結果讀進記憶體。
+        """
+        ref = self.ref(key)
+        meta = self.blobs.get_meta(ref) if ref else None
+        return self._touch(key, ref, meta)
+
+    def _touch(self, key: str, ref: str | None, found: dict | None) -> tuple[str, dict] | None:
+        if found is None:
+            self._count("misses")
+            return None
+        with self._conn() as c:
+            c.execute("UPDATE result_cache SET last_access=? WHERE key=?", (time.time(), key))
+        self._count("hits")
+        return ref, found
+
     def get(self, key: str) -> dict | None:
+        hit = self.lookup(key)
+        return hit[1] if hit else None
+
+    def put(self, key: str, result: dict, result_hash: str | None = None) -> str:
+        """寫入快取並回傳結果的 blob hash；已知 hash（結果已存入 blob）時直接引用。"""
+        ref = result_hash or self.blobs.put(result)
+        now = time.time()
+        with self._conn() as c:
+            c.execute(
+                "INSERT OR REPLACE INTO result_cache(key, result, result_hash, created_at, last_access, size) "
+                "VALUES (?,'',?,?,?,?)",
+                (key, ref, now, now, self.blobs.stored_size(ref)),
+            )
+        return ref
+
+    def evict(self, max_bytes: int = 0, max_entries: int = 0, ttl: float = 0) -> int:
+        """依上限淘汰並回傳刪除筆數（各上限為 0 表示不限）。
+
+        先刪建立超過 ttl 秒的過期項，再從最近使用的往回保留，超出筆數或總位元組的較舊項一併刪除。
+        結果 blob 仍被歷史紀錄引用時不受影響，沒人引用的由 sweeper 另行回收。
+        """
+        now = time.time()
+        with self._conn() as c:
+            rows = c.execute(
+                "SELECT key, size, created_at FROM result_cache ORDER BY last_access DESC"
+            ).fetchall()
+            total = kept = 0
+            full = False   # 一旦超出上限，之後更舊的項目一律淘汰（嚴格 LRU，不讓較小的舊項目留下）
+            doomed: list[tuple[str]] = []
+            for key, size, created_at in rows:
+                if not full and (max_entries and kept >= max_entries
+                                 or max_bytes and total + size > max_bytes):
+                    full = True
+                if full or ttl and now - created_at > ttl:
+                    doomed.append((key,))
+                    continue
+                kept += 1
+                total += size
+            c.executemany("DELETE FROM result_cache WHERE key=?", doomed)
+        self._count("evictions", len(doomed))
+        return len(doomed)
+
+    def refs(self) -> set[str]:
+        """目前快取引用到的所有 blob hash。"""
+        with self._conn() as c:
+            rows = c.execute(
+                "SELECT DISTINCT result_hash FROM result_cache WHERE result_hash IS NOT NULL"
+            ).fetchall()
+        return {r[0] for r in rows}
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._count_lock:
+            self._counts[name] += n
+
+    def stats(self) -> dict:
+        """筆數、總位元組與本行程啟動以來的命中/未命中/淘汰次數。"""
+        with self._conn() as c:
+            entries, size = c.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM result_cache").fetchone()
+        with self._count_lock:
+            counts = dict(self._counts)
+        looked = counts["hits"] + counts["misses"]
+        return {"entries": entries, "bytes": size, **counts,
+                "hit_ratio": round(counts["hits"] / looked, 3) if looked else None}
+
+
+class ChatCache:
+    """單次 chat 呼叫的快取：key = hash(model, system, user, max_tokens, temperature)。"""
+
+    def __init__(self, db_path: str | Path):
+        self.db_path = str(db_path)
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._init()
+
+    def _conn(self) -> sqlite3.Connection:
+        return connect(self.db_path)   # 本執行緒共用的長駐連線（WAL），見 db.py
+
+    def _init(self) -> None:
+        with self._conn() as c:
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS chat_cache ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, "
+                "completion_tokens INTEGER DEFAULT 0, created_at REAL NOT NULL)"
+            )
+            c.execute("CREATE INDEX IF NOT EXISTS idx_chat_cache_created ON chat_cache(created_at)")
+
+    @staticmethod
+    def make_key(model: str, system: str, user: str, max_tokens: int, temperature: float) -> str:
+        raw = json.dumps([model, system, user, max_tokens, temperature], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> tuple[str, int] | None:
         with self._conn() as c:
-            row = c.execute("SELECT result FROM result_cache WHERE key=?", (key,)).fetchone()
-        return json.loads(row[0]) if row else None
+            row = c.execute(
+                "SELECT text, completion_tokens FROM chat_cache WHERE key=?", (key,)
+            ).fetchone()
+        return (row[0], int(row[1])) if row else None
 
-    def put(self, key: str, result: dict) -> None:
+    def put(self, key: str, text: str, completion_tokens: int) -> None:
         with self._conn() as c:
             c.execute(
-                "INSERT OR REPLACE INTO result_cache(key, result, created_at) VALUES (?,?,?)",
-                (key, json.dumps(result, ensure_ascii=False), time.time()),
+                "INSERT OR REPLACE INTO chat_cache(key, text, completion_tokens, created_at) "
+                "VALUES (?,?,?,?)",
+                (key, text, completion_tokens, time.time()),
             )
 
+    def evict(self, max_entries: int = 0, ttl: float = 0) -> int:
+        with self._conn() as c:
+            return _trim(c, "chat_cache", max_entries, ttl)
+
+
+class PageCache:
+    """逐頁擷取快取。
+
+    - page_text：key = (PDF hash, 擷取變體, 頁碼)；變體區分是否 OCR 與 OCR 參數
+    - ocr_text：key = 頁面 PNG 的 sha256，跨文件共用
+
+    擷取行程池的子行程會各自以 db_path 開一個實例寫入 OCR 結果（SQLite 本身處理跨行程鎖）。
+    """
+
+    def __init__(self, db_path: str | Path):
+        self.db_path = str(db_path)
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._init()
+
+    def _conn(self) -> sqlite3.Connection:
+        return connect(self.db_path)   # 本執行緒共用的長駐連線（WAL），見 db.py
+
+    def _init(self) -> None:
+        with self._conn() as c:
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS page_text ("
+                "digest TEXT NOT NULL, variant TEXT NOT NULL, page INTEGER NOT NULL, "
+                "text TEXT NOT NULL, created_at REAL NOT NULL, PRIMARY KEY(digest, variant, page))"
+            )
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_text ("
+                "image_hash TEXT PRIMARY KEY, text TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            c.execute("CREATE INDEX IF NOT EXISTS idx_page_text_created ON page_text(created_at)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_ocr_text_created ON ocr_text(created_at)")
+
+    def get_pages(self, digest: str, variant: str) -> dict[int, str]:
+        with self._conn() as c:
+            rows = c.execute(
+                "SELECT page, text FROM page_text WHERE digest=? AND variant=?", (digest, variant)
+            ).fetchall()
+        return {int(page): text for page, text in rows}
+
+    def put_pages(self, digest: str, variant: str, pages: dict[int, str]) -> None:
+        if not pages:
+            return
+        now = time.time()
+        with self._conn() as c:
+            c.executemany(
+                "INSERT OR REPLACE INTO page_text(digest, variant, page, text, created_at) "
+                "VALUES (?,?,?,?,?)",
+                [(digest, variant, page, text, now) for page, text in pages.items()],
+            )
+
+    def get_ocr(self, image_hash: str) -> str | None:
+        with self._conn() as c:
+            row = c.execute("SELECT text FROM ocr_text WHERE image_hash=?", (image_hash,)).fetchone()
+        return row[0] if row else None
+
+    def put_ocr(self, image_hash: str, text: str) -> None:
+        with self._conn() as c:
+            c.execute(
+                "INSERT OR REPLACE INTO ocr_text(image_hash, text, created_at) VALUES (?,?,?)",
+                (image_hash, text, time.time()),
+            )
+
+    def evict(self, max_entries: int = 0, ttl: float = 0) -> int:
+        """逐頁文字與 OCR 輸出各自套用上限，回傳刪除列數合計。"""
+        with self._conn() as c:
+            return _trim(c, "page_text", max_entries, ttl) + _trim(c, "ocr_text", max_entries, ttl)
+
 
 _cache: ResultCache | None = None
+_chat_cache: ChatCache | None = None
+_page_cache: PageCache | None = None
 
 
 def get_cache() -> ResultCache:
@@ -55,3 +311,21 @@ def get_cache() -> ResultCache:
 
         _cache = ResultCache(settings.storage_dir / "cache.db")
     return _cache
+
+
+def get_chat_cache() -> ChatCache:
+    global _chat_cache
+    if _chat_cache is None:
+        from ..core.config import settings
+
+        _chat_cache = ChatCache(settings.storage_dir / "llm_cache.db")
+    return _chat_cache
+
+
+def get_page_cache() -> PageCache:
+    global _page_cache
+    if _page_cache is None:
+        from ..core.config import settings
+
+        _page_cache = PageCache(settings.storage_dir / "pages.db")
+    return _page_cache
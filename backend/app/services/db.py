@@ -0,0 +1,43 @@
+"""SQLite 連線層：所有持久化元件（結果快取、LLM 呼叫快取、頁面快取、歷史紀錄）共用。
+
+每條執行緒對每個資料庫檔保有一條長駐連線（sqlite3 連線不可跨執行緒），取代「每次操作開新連線」：
+- WAL：讀者不擋寫者，多個 job 同時完成寫入時，狀態輪詢的讀取不必排隊
+- synchronous=NORMAL：WAL 下仍保證一致性，只是斷電時可能遺失最後幾筆交易（皆為可重算的快取/紀錄）
+- cache_size / temp_store：常用頁面留在連線自己的頁面快取
+- busy_timeout：寫鎖被佔用時等待而非立刻丟 database is locked
+- 連線長駐，sqlite3 內建的已編譯語句快取（cached_statements）才真的會被重用
+
+連線跟著執行緒的生命週期：執行緒結束時 threading.local 釋放，連線隨之關閉。
+"""
+from __future__ import annotations
+
+import sqlite3
+import threading
+
+_local = threading.local()
+
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8192",     # 負值單位為 KiB：每條連線 8 MiB 頁面快取
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=10000",
+)
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """取得本執行緒對 db_path 的共用連線（首次呼叫時建立並套用 pragma）。
+
+    以 `with connect(path) as c:` 使用即為一筆交易（離開時 commit、例外時 rollback），連線不會被關閉。
+    不要改動連線層級的狀態（如 row_factory）；需要時設在 cursor 上。
+    """
+    conns: dict[str, sqlite3.Connection] | None = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=10, cached_statements=256)
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        conns[db_path] = conn
+    return conn
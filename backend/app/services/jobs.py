@@ -1,18 +1,34 @@
 """非同步任務管理（Phase 2：記憶體版；Phase 3 再換 SQLite 快取）。
 
-上傳後立即回傳 doc_id，背景執行緒跑 pipeline 並更新進度，前端輪詢 /status、/result。
+上傳後立即回傳 doc_id，背景執行緒跑 pipeline 並更新進度，前端輪詢 /status、/result；
+?stream=1 則以 events() 訂閱同一個 job 的事件轉成 NDJSON。
+
+同一個快取 key（同內容 + 同變體）已有分析在跑時不再另起 pipeline：後到的 job 掛在
+進行中的 job 之下（single-flight），共用其進度與結果，但各自保有 doc_id 與歷史紀錄。
+
+pipeline 由固定數量的工作執行緒（JOB_WORKERS）從優先佇列取出執行，突發大量上傳時
+排隊等候而非同時壓垮推理端點；互動式串流 > 小檔 > 大批次，同優先序先到先做。
 """
 from __future__ import annotations
 
+import heapq
+import itertools
+import queue
+import shutil
 import threading
 import uuid
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Iterator, Optional
 
 from ..core.config import Settings
 from .pipeline import run_pipeline
 
+# 排程優先序（數字小者先做）
+PRIORITY_INTERACTIVE = 0   # ?stream=1：使用者正盯著畫面
+PRIORITY_SMALL = 1         # 小檔：很快就能做完，不該排在大檔後面
+PRIORITY_BULK = 2
+
 
 @dataclass
 class Job:
@@ -22,12 +38,25 @@ class Job:
     message: str = ""
     error: Optional[str] = None
     result: Optional[dict] = None
+    followers: list["Job"] = field(default_factory=list, repr=False)   # 掛在此 job 下的重複上傳
+    listeners: list[queue.Queue] = field(default_factory=list, repr=False)  # events() 訂閱者
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "error")
 
 
 class JobManager:
     def __init__(self):
         self._jobs: dict[str, Job] = {}
+        self._inflight: dict[str, Job] = {}   # cache_key → 正在跑的 job
         self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        # 待執行佇列（heap）：(priority, seq, job, task)；seq 保證同優先序 FIFO
+        self._pending: list[tuple[int, int, Job, Callable[[], None]]] = []
+        self._seq = itertools.count()
+        self._workers: list[threading.Thread] = []
+        self.last_error: str | None = None   # 最近一次背景任務的未預期錯誤（/healthz 顯示）
 
     def create(self) -> Job:
         doc_id = uuid.uuid4().hex[:16]
@@ -39,44 +68,234 @@ class JobManager:
     def get(self, doc_id: str) -> Optional[Job]:
         return self._jobs.get(doc_id)
 
+    def active_digests(self) -> set[str]:
+        """排隊或分析中的 PDF hash（cache_key 開頭）；這些上傳檔還會被 pipeline 讀取。"""
+        with self._lock:
+            return {key.split("|", 1)[0] for key in self._inflight}
+
     def run_async(self, job: Job, pdf_path: Path, settings: Settings,
                   do_summary: bool = True, do_translate: bool = True,
                   do_wordcloud: bool = True, do_report: bool = True,
-                  cache_key: str | None = None) -> None:
-        """在背景執行緒跑 pipeline，逐事件更新 job 狀態；完成後寫入快取。"""
+                  cache_key: str | None = None, refresh: bool = False,
+                  stream_deltas: bool = False, priority: int | None = None,
+                  digest: str | None = None) -> None:
+        """排入佇列，由背景工作執行緒跑 pipeline，逐事件更新 job 狀態；完成後寫入快取。
+
+        同 cache_key 已有 job 在跑（且非 refresh）時，只把 job 掛上去，不重複推理。
+        priority 未指定時依檔案大小分成小檔/大批次。
+        """
+        if priority is None:
+            small = Path(pdf_path).stat().st_size <= settings.small_doc_mb * 1024 * 1024
+            priority = PRIORITY_SMALL if small else PRIORITY_BULK
+        with self._lock:
+            leader = self._inflight.get(cache_key) if cache_key and not refresh else None
+            if leader is not None:
+                leader.followers.append(job)
+                job.status, job.progress = leader.status, leader.progress
+                job.message = f"相同文件分析中，共用進度：{leader.message}"
+                self._boost(leader, priority)
+                return
+            if cache_key:
+                self._inflight[cache_key] = job
+
         def _worker():
-            job.status = "processing"
-            for event in run_pipeline(pdf_path, settings, do_summary, do_translate,
-                                      do_wordcloud, do_report, doc_id=job.doc_id):
-                job.progress = event.get("progress", job.progress)
-                job.message = event.get("message", job.message)
-                if event["type"] == "result":
-                    job.result = event.get("data")
-                    job.status = "done"
-                    if job.result is not None:
-                        from .store import get_store
-
-                        get_store().finish(job.doc_id, job.result)
-                        if cache_key:
-                            from .cache import get_cache
-
-                            get_cache().put(cache_key, job.result)
-                elif event["type"] == "error":
-                    job.error = event.get("message")
-                    job.status = "error"
-                    from .store import get_store
-
-                    get_store().fail(job.doc_id, job.error or "error")
-
-        threading.Thread(target=_worker, daemon=True).start()
-
-    def seed_done(self, result: dict) -> Job:
-        """快取命中：直接建立一個已完成的 job。"""
+            with self._lock:
+                for j in (job, *job.followers):
+                    j.status = "processing"
+            try:
+                for event in run_pipeline(pdf_path, settings, do_summary, do_translate,
+                                          do_wordcloud, do_report, doc_id=job.doc_id,
+                                          refresh=refresh, stream_deltas=stream_deltas,
+                                          digest=digest):
+                    if event["type"] in ("result", "error"):
+                        self._finish(job, event, settings, cache_key)
+                        break
+                    self._emit(job, event)
+            except Exception as e:  # noqa: BLE001  例如寫入快取/歷史或複製報告失敗
+                self.last_error = f"{type(e).__name__}: {e}"
+                self._abort(job, f"處理失敗：{e}")
+            finally:
+                if cache_key:
+                    with self._lock:
+                        if self._inflight.get(cache_key) is job:
+                            del self._inflight[cache_key]
+
+        self._submit(job, _worker, priority, settings.job_workers)
+
+    # ── 排程 ──
+    def _submit(self, job: Job, task: Callable[[], None], priority: int, workers: int) -> None:
+        with self._cond:
+            heapq.heappush(self._pending, (priority, next(self._seq), job, task))
+            while len(self._workers) < max(1, workers):
+                t = threading.Thread(target=self._work, daemon=True)
+                self._workers.append(t)
+                t.start()
+            self._cond.notify()
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                *_, task = heapq.heappop(self._pending)
+            try:
+                task()
+            except Exception as e:  # noqa: BLE001  單一任務失敗不能讓工作執行緒死掉（不會有人補上）
+                self.last_error = f"{type(e).__name__}: {e}"
+
+    def _boost(self, job: Job, priority: int) -> None:
+        """後到的 follower 更急（例如串流）時，提高仍在排隊的 leader 優先序。呼叫端持有鎖。"""
+        for k, (p, seq, j, task) in enumerate(self._pending):
+            if j is job and priority < p:
+                self._pending[k] = (priority, seq, j, task)
+                heapq.heapify(self._pending)
+                return
+
+    def position(self, job: Job) -> Optional[int]:
+        """排隊中的 job 回傳名次（1 = 下一個執行）；已開始或已結束回 None。"""
+        with self._lock:
+            leader = next((j for j in self._inflight.values() if job in j.followers), job)
+            order = sorted(self._pending)
+            for k, (_, _, j, _) in enumerate(order):
+                if j is leader:
+                    return k + 1
+        return None
+
+    @staticmethod
+    def _publish(job: Job, event: dict) -> None:
+        # 呼叫端須持有 self._lock，確保與 events() 的「檢查完成 → 訂閱」不交錯
+        for q in job.listeners:
+            q.put(event)
+
+    def _emit(self, leader: Job, event: dict) -> None:
+        with self._lock:
+            for j in (leader, *leader.followers):
+                if event["type"] != "delta":
+                    j.status = "processing"
+                    j.progress = event.get("progress", j.progress)
+                    j.message = event.get("message", j.message)
+                self._publish(j, event)
+
+    def _finish(self, leader: Job, event: dict, settings: Settings, cache_key: str | None) -> None:
+        from .store import get_store
+
+        store = get_store()
+        with self._lock:  # 先退出 in-flight，之後到的同 key 上傳改走快取或另起 job
+            if cache_key and self._inflight.get(cache_key) is leader:
+                del self._inflight[cache_key]
+            group = [leader, *leader.followers]
+
+        result = event.get("data") if event["type"] == "result" else None
+        if result is not None:
+            try:
+                result = self._validated(result)
+            except ValueError as e:  # pydantic ValidationError 為 ValueError 子類
+                result = None
+                event = {"type": "error", "progress": 100, "message": f"結果格式錯誤：{e}", "data": None}
+        ref = None   # leader 結果的 blob hash：快取與 leader 的歷史紀錄共用同一份
+        if result is not None:
+            from .blobs import get_blobs
+
+            ref = get_blobs().put(result)
+            if cache_key:
+                from .cache import get_cache
+
+                get_cache().put(cache_key, result, result_hash=ref)
+        for j in group:
+            if result is not None:
+                j.result = result if j is leader else self._adopt(result, leader, j, settings)
+                store.finish(j.doc_id, j.result, result_hash=ref if j.result is result else None)
+            else:
+                j.error = event.get("message") or "error"
+                store.fail(j.doc_id, j.error)
+            with self._lock:
+                j.progress = event.get("progress", 100)
+                j.message = event.get("message", j.message)
+                j.status = "done" if result is not None else "error"
+                self._publish(j, {**event, "data": j.result} if result is not None else event)
+
+    def _abort(self, leader: Job, message: str) -> None:
+        """_finish 途中失敗：尚未結束的 job 一律標為錯誤並送出 error 事件，讓輪詢與串流都能結束。"""
+        from .store import get_store
+
+        event = {"type": "error", "progress": 100, "message": message, "data": None}
+        with self._lock:
+            group = [j for j in (leader, *leader.followers) if not j.finished]
+        for j in group:
+            try:
+                get_store().fail(j.doc_id, message)
+            except Exception as e:  # noqa: BLE001  歷史紀錄寫不進去仍要結束記憶體中的狀態
+                self.last_error = f"{type(e).__name__}: {e}"
+            with self._lock:
+                j.error = message
+                j.progress = 100
+                j.message = message
+                j.status = "error"
+                self._publish(j, event)
+
+    @staticmethod
+    def _validated(result: dict) -> dict:
+        """寫入前依 ResultResponse 驗證並正規化一次；之後讀取直接回傳存好的 JSON，不再逐次驗證。"""
+        from ..models.schemas import ResultResponse
+
+        return ResultResponse.model_validate({"doc_id": "", **result}).model_dump(
+            mode="json", exclude={"doc_id"})
+
+    @staticmethod
+    def _adopt(result: dict, leader: Job, job: Job, settings: Settings) -> dict:
+        """把 leader 的結果轉給 follower：報告複製成 follower 自己的檔案，刪除時互不影響。"""
+        out = dict(result)
+        if result.get("report_pdf_url"):
+            reports = settings.storage_dir / "reports"
+            src = reports / f"{leader.doc_id}.pdf"
+            if src.exists():
+                shutil.copyfile(src, reports / f"{job.doc_id}.pdf")
+                out["report_pdf_url"] = f"/documents/{job.doc_id}/report.pdf"
+        return out
+
+    def events(self, job: Job) -> Iterator[dict]:
+        """訂閱 job 的事件（含 delta），直到 result/error 為止；供 NDJSON 串流使用。"""
+        q: queue.Queue = queue.Queue()
+        with self._lock:
+            finished = job.finished
+            if not finished:
+                job.listeners.append(q)
+        if finished:
+            yield self._snapshot(job)
+            return
+        try:
+            pos = self.position(job)
+            if pos is not None:
+                yield {"type": "progress", "progress": 0,
+                       "message": f"排隊中（第 {pos} 位）", "data": None}
+            elif job.status != "queued" or job.progress:  # 中途掛上的 follower 先補一筆目前進度
+                yield {"type": "progress", "progress": job.progress,
+                       "message": job.message, "data": None}
+            while True:
+                event = q.get()
+                yield event
+                if event["type"] in ("result", "error"):
+                    return
+        finally:
+            with self._lock:
+                if q in job.listeners:
+                    job.listeners.remove(q)
+
+    @staticmethod
+    def _snapshot(job: Job) -> dict:
+        if job.status == "done":
+            return {"type": "result", "progress": 100, "message": job.message, "data": job.result}
+        return {"type": "error", "progress": 100, "message": job.error or "error", "data": None}
+
+    def seed_done(self) -> Job:
+        """快取命中：直接建立一個已完成的 job。
+
+        結果不放在 job 上（result=None）：結果已在 blob 中，/result 與串流的 result 事件都直接讀 blob bytes。
+        """
         job = self.create()
         job.status = "done"
         job.progress = 100
         job.message = "快取命中"
-        job.result = result
         return job
 
 
@@ -3,6 +3,10 @@ from __future__ import annotations
 
 import re
 from collections import Counter
+from typing import TYPE_CHECKING, Iterable
+
+if TYPE_CHECKING:
+    from .textproc import PageProfile
 
 # 常見英文停用詞（精簡內建版，避免 NLTK 需下載語料）
 _EN_STOP = {
@@ -18,11 +22,14 @@ _EN_STOP = {
 }
 
 
-def detect_language(text: str) -> str:
-    """回傳 ISO 639-1 語言碼。CJK 先用字元集確定性判斷，其餘才交給 langdetect。"""
-    from .textproc import script_language
+def detect_language(text: str, profiles: Iterable[PageProfile] | None = None) -> str:
+    """回傳 ISO 639-1 語言碼。CJK 先用字元集確定性判斷，其餘才交給 langdetect。
+
+    給 profiles（各頁剖析結果）時直接加總其字元集計數，不再重掃 text。
+    """
+    from .textproc import profiles_language, script_language
 
-    lang = script_language(text)
+    lang = profiles_language(profiles) if profiles is not None else script_language(text)
     if lang:
         return lang
     try:
@@ -35,9 +42,9 @@ def detect_language(text: str) -> str:
         return "en"
 
 
-def extract_keywords(text: str, top_k: int = 60) -> list[tuple[str, float]]:
-    """回傳 [(word, weight), ...]，權重已正規化到 (0, 1]。"""
-    lang = detect_language(text)
+def extract_keywords(text: str, top_k: int = 60, lang: str | None = None) -> list[tuple[str, float]]:
+    """回傳 [(word, weight), ...]，權重已正規化到 (0, 1]。lang 已知（pipeline 已判定）時不再偵測。"""
+    lang = lang or detect_language(text)
     if lang == "zh":
         import jieba.analyse
 
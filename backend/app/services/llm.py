@@ -1,12 +1,32 @@
-"""OpenAI 相容端點的極簡 client（llama-server / Ollama 皆可）。摘要與翻譯共用。"""
+"""OpenAI 相容端點的極簡 client（llama-server / Ollama 皆可）。摘要與翻譯共用。
+
+整個行程共用一個帶連線池的 httpx.Client（執行緒安全），由 get_llm() 取得；
+所有文件的任務與 /healthz 都重用同一組 keep-alive 連線，不再每次重建 TCP。
+
+SUMMARIZE_URL 可給多個以逗號分隔的副本：每次請求挑在途請求最少的健康端點，
+逾時/連線失敗/5xx 的端點暫時剔除，chat 改送另一個副本重試（指數退避）。
+
+重複偵測（repeat_guard）開啟時 chat 一律走 SSE：尾端出現週期性重複迴圈就中斷連線，
+不讓失控生成一路燒到 max_tokens。
+"""
 from __future__ import annotations
 
+import copy
+import itertools
+import json
 import re
+import threading
 import time
 from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, TypeVar
 
 import httpx
 
+if TYPE_CHECKING:
+    from .cache import ChatCache
+
+T = TypeVar("T")
+
 # Qwen3/Qwen3.5 等推理型模型可能輸出 <think>…</think>，摘要/翻譯要濾掉
 _THINK = re.compile(r"<think>.*?</think>", re.DOTALL | re.IGNORECASE)
 
@@ -15,26 +35,258 @@ def strip_think(text: str) -> str:
     return _THINK.sub("", text).strip()
 
 
+class ThinkFilter:
+    """串流版的 strip_think：逐 delta 餵入，只吐出 <think> 區塊以外的文字。
+
+    標籤可能被切在兩個 delta 之間，尾端「可能是標籤開頭」的片段先留在緩衝，下一塊再判斷。
+    """
+
+    _OPEN, _CLOSE = "<think>", "</think>"
+
+    def __init__(self):
+        self._buf = ""
+        self._inside = False
+
+    @staticmethod
+    def _partial(buf: str, tag: str) -> int:
+        low = buf.lower()
+        for k in range(min(len(tag) - 1, len(buf)), 0, -1):
+            if low.endswith(tag[:k]):
+                return k
+        return 0
+
+    def feed(self, piece: str) -> str:
+        self._buf += piece
+        out: list[str] = []
+        while self._buf:
+            tag = self._CLOSE if self._inside else self._OPEN
+            j = self._buf.lower().find(tag)
+            if j < 0:
+                keep = self._partial(self._buf, tag)
+                if not self._inside:
+                    out.append(self._buf[:len(self._buf) - keep])
+                self._buf = self._buf[len(self._buf) - keep:]
+                break
+            if not self._inside:
+                out.append(self._buf[:j])
+            self._buf = self._buf[j + len(tag):]
+            self._inside = not self._inside
+        return "".join(out)
+
+    def flush(self) -> str:
+        rest = "" if self._inside else self._buf
+        self._buf = ""
+        return rest
+
+
+def repeating_tail(text: str, min_len: int = 240, max_period: int = 120) -> int:
+    """text 尾端至少 min_len 字元是週期 ≤ max_period 的重複（且至少三輪）時回傳週期，否則回 0。"""
+    for p in range(1, max_period + 1):
+        n = max(min_len, 3 * p)
+        if len(text) < n:
+            break
+        region = text[-n:]
+        if region[p:] == region[:-p]:
+            return p
+    return 0
+
+
+def trim_repetition(text: str) -> str:
+    """把尾端的重複迴圈收斂成只留一輪。"""
+    p = repeating_tail(text)
+    if not p:
+        return text
+    i = len(text) - max(240, 3 * p)
+    while i > 0 and text[i - 1] == text[i - 1 + p]:  # 往前找出週期開始處
+        i -= 1
+    return text[:i + p].rstrip()
+
+
 @dataclass
 class ChatResult:
     text: str
     elapsed: float
     completion_tokens: int = 0
+    cached: bool = False
+    degenerate: bool = False      # 偵測到重複迴圈而提前中斷（text 已去掉重複尾巴）
+    truncated: bool = False       # 頂到 max_tokens 被截斷（finish_reason=length）
+
+
+@dataclass
+class Endpoint:
+    """一個推理端點（llama-server / Ollama 副本）的路由狀態。"""
+    url: str
+    outstanding: int = 0          # 在途請求數
+    ejected_until: float = 0.0    # monotonic 時間；之前不分派新請求
+    latency: float = 0.0          # 成功請求耗時的指數移動平均（秒）
+    requests: int = 0
+    failures: int = 0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "latency_ms": round(self.latency * 1000, 1),
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+def _failover(e: Exception) -> bool:
+    """是否為端點本身的問題（值得剔除並換副本重試）；4xx 屬請求錯誤，換副本也一樣。"""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500
+    return isinstance(e, httpx.TransportError)
 
 
 class LLMClient:
-    def __init__(self, base_url: str, model: str, timeout: float = 600.0):
-        self.base_url = base_url.rstrip("/")
+    def __init__(self, base_url: str, model: str, timeout: float = 600.0,
+                 client: httpx.Client | None = None, cache: ChatCache | None = None,
+                 retries: int = 2, eject_seconds: float = 30.0, cache_prompt: bool = True,
+                 repeat_guard: bool = True):
+        # base_url 可為逗號分隔的多個副本
+        self.endpoints = [Endpoint(u.strip().rstrip("/")) for u in base_url.split(",") if u.strip()]
+        self.base_url = self.endpoints[0].url
         self.model = model
-        self.client = httpx.Client(timeout=timeout)
+        self.client = client or httpx.Client(timeout=timeout)
+        self.cache = cache
+        self.read_cache = True
+        self.retries = retries
+        self.eject_seconds = eject_seconds
+        self.cache_prompt = cache_prompt
+        self.repeat_guard = repeat_guard
+        self.slots: tuple[int, ...] = ()         # llama-server id_slot 候選；空 = 由 server 挑
+        self._slot_seq = itertools.count()
+        self._route_lock = threading.Lock()
+        self._tokenize_ok: bool | None = None   # None = 尚未探測 /tokenize
+
+    def fresh(self) -> LLMClient:
+        """共用連線池、但不讀呼叫快取的副本（結果仍寫回），供 refresh=1 強制重新推理。"""
+        clone = copy.copy(self)
+        clone.read_cache = False
+        return clone
+
+    def pinned(self, slots: list[int]) -> LLMClient:
+        """只送往 llama-server 指定槽（id_slot）的副本，請求在這幾個槽之間輪流分派。
+
+        同一組槽只接同一種系統提示的請求，KV cache 前綴可一直重用、不被其他任務洗掉；
+        給多個槽則平行的請求不會全擠在同一槽排隊（指定的槽忙碌時 server 不會改派）。
+        """
+        clone = copy.copy(self)
+        clone.slots = tuple(slots)
+        clone._slot_seq = itertools.count()
+        return clone
+
+    # ── 路由 ──
+    def _acquire(self, tried: list[Endpoint]) -> Endpoint:
+        """挑在途請求最少的健康端點（同分取延遲較低者）；全被剔除時挑最快恢復的。"""
+        with self._route_lock:
+            pool = [e for e in self.endpoints if e not in tried] or self.endpoints
+            healthy = [e for e in pool if e.healthy]
+            if healthy:
+                ep = min(healthy, key=lambda e: (e.outstanding, e.latency))
+            else:
+                ep = min(pool, key=lambda e: e.ejected_until)
+            ep.outstanding += 1
+            ep.requests += 1
+        return ep
+
+    def _release(self, ep: Endpoint, elapsed: float | None, eject: bool = False) -> None:
+        with self._route_lock:
+            ep.outstanding -= 1
+            if elapsed is not None:
+                ep.latency = elapsed if not ep.latency else 0.8 * ep.latency + 0.2 * elapsed
+            if eject:
+                ep.failures += 1
+                ep.ejected_until = time.monotonic() + self.eject_seconds
+
+    def _routed(self, call: Callable[[str], T], can_retry: Callable[[], bool] = lambda: True) -> T:
+        """把 call(url) 分派到端點；端點故障時剔除並換副本重試（chat 為冪等請求）。"""
+        tried: list[Endpoint] = []
+        for attempt in range(self.retries + 1):
+            ep = self._acquire(tried)
+            start = time.perf_counter()
+            try:
+                out = call(ep.url)
+            except Exception as e:
+                bad = _failover(e)
+                self._release(ep, None, eject=bad)
+                if not bad or attempt == self.retries or not can_retry():
+                    raise
+                tried.append(ep)
+                time.sleep(min(4.0, 0.5 * 2 ** attempt))
+                continue
+            self._release(ep, time.perf_counter() - start)
+            return out
+        raise AssertionError("unreachable")
+
+    def stats(self) -> list[dict]:
+        """各端點的健康狀態、在途請求數與平均延遲（供 /healthz）。"""
+        with self._route_lock:
+            return [e.stats() for e in self.endpoints]
 
     def ping(self) -> list[str]:
-        """回傳端點可用的模型 id 清單；連不上則丟例外。"""
-        r = self.client.get(f"{self.base_url}/models")
-        r.raise_for_status()
-        return [m.get("id", "?") for m in r.json().get("data", [])]
+        """逐一探測各端點，回傳可用的模型 id 清單；全部連不上則丟例外。連不上的端點會被剔除。"""
+        models: list[str] = []
+        error: Exception | None = None
+        for ep in self.endpoints:
+            try:
+                r = self.client.get(f"{ep.url}/models")
+                r.raise_for_status()
+                models.extend(m.get("id", "?") for m in r.json().get("data", []))
+            except httpx.HTTPError as e:
+                error = e
+                self._eject(ep)
+        if not models and error is not None:
+            raise error
+        return sorted(set(models))
+
+    def _eject(self, ep: Endpoint) -> None:
+        with self._route_lock:
+            ep.failures += 1
+            ep.ejected_until = time.monotonic() + self.eject_seconds
+
+    def count_tokens(self, text: str) -> int:
+        """用 llama-server 的 /tokenize 精確計數；端點不支援（如 Ollama）時退回字元集估算。"""
+        from .textproc import estimate_tokens
+
+        if self._tokenize_ok is not False:
+            ep = next((e for e in self.endpoints if e.healthy), self.endpoints[0])
+            root = ep.url.removesuffix("/v1")  # /tokenize 不在 OpenAI 相容路徑下
+            try:
+                r = self.client.post(f"{root}/tokenize", json={"content": text})
+                r.raise_for_status()
+                n = len(r.json()["tokens"])
+                self._tokenize_ok = True
+                return n
+            except (httpx.HTTPError, KeyError, TypeError, ValueError):
+                if self._tokenize_ok is None:  # 第一次就失敗 → 視為不支援，之後不再嘗試
+                    self._tokenize_ok = False
+        return estimate_tokens(text)
+
+    def chat(self, system: str, user: str, max_tokens: int, temperature: float = 0.3,
+             on_delta: Callable[[str], None] | None = None) -> ChatResult:
+        """送出一次 chat。給 on_delta 時改用 SSE 串流，每收到可見文字片段就回呼一次。
+
+        repeat_guard 開啟時即使沒有 on_delta 也走串流，以便偵測到重複迴圈時提前中斷；
+        中斷的結果標記 degenerate、去掉重複尾巴，且不寫入呼叫快取（下次重新生成）。
+        因長度被截斷的結果標記 truncated，同樣不寫入快取；快取中用滿 max_tokens 的舊項目視為未命中。
+        """
+        start = time.perf_counter()
+        key = None
+        if self.cache is not None:
+            key = self.cache.make_key(self.model, system, user, max_tokens, temperature)
+            hit = self.cache.get(key) if self.read_cache else None
+            if hit is not None and hit[1] < max_tokens:
+                if on_delta:
+                    on_delta(hit[0])
+                return ChatResult(hit[0], time.perf_counter() - start, hit[1], cached=True)
 
-    def chat(self, system: str, user: str, max_tokens: int, temperature: float = 0.3) -> ChatResult:
         payload = {
             "model": self.model,
             "messages": [
@@ -46,12 +298,142 @@ class LLMClient:
             # 關掉推理型模型（如 Qwen3.5）的 thinking，否則 token 全花在推理、content 會空。
             # 標準 OpenAI 參數，非推理模型/其他 server 會忽略。
             "reasoning_effort": "none",
+            # llama-server 擴充參數：重用與上一個請求相同前綴（系統提示）的 KV cache，免重新 prefill。
+            # Ollama 等其他 server 會忽略。
+            "cache_prompt": self.cache_prompt,
         }
-        start = time.perf_counter()
-        r = self.client.post(f"{self.base_url}/chat/completions", json=payload)
+        if self.slots:
+            payload["id_slot"] = self.slots[next(self._slot_seq) % len(self.slots)]
+        degenerate = False
+        if on_delta or self.repeat_guard:
+            emitted = False
+
+            def relay(text: str) -> None:
+                nonlocal emitted
+                if on_delta:   # 沒有串流接收者時沒送出任何東西，失敗仍可換副本重試
+                    emitted = True
+                    on_delta(text)
+
+            # 已送出部分文字就不能換副本重來，否則前端會收到重複片段
+            raw, tokens, finish, degenerate = self._routed(
+                lambda url: self._stream(url, payload, relay), can_retry=lambda: not emitted)
+        else:
+            raw, tokens, finish = self._routed(lambda url: self._complete(url, payload))
+        elapsed = time.perf_counter() - start
+        text = strip_think(raw)
+        truncated = finish == "length"
+        if degenerate:
+            text = trim_repetition(text)
+        elif key is not None and text and not truncated:
+            self.cache.put(key, text, tokens)
+        return ChatResult(text, elapsed, tokens, degenerate=degenerate, truncated=truncated)
+
+    def _complete(self, url: str, payload: dict) -> tuple[str, int, str | None]:
+        """一般請求：回傳 (完整原文, completion_tokens, finish_reason)。"""
+        r = self.client.post(f"{url}/chat/completions", json=payload)
         r.raise_for_status()
         data = r.json()
-        elapsed = time.perf_counter() - start
-        text = strip_think(data["choices"][0]["message"]["content"])
-        usage = data.get("usage") or {}
-        return ChatResult(text, elapsed, int(usage.get("completion_tokens", 0)))
+        tokens = int((data.get("usage") or {}).get("completion_tokens", 0))
+        choice = data["choices"][0]
+        return choice["message"]["content"], tokens, choice.get("finish_reason")
+
+    def _stream(self, url: str, payload: dict,
+                on_delta: Callable[[str], None]) -> tuple[str, int, str | None, bool]:
+        """OpenAI 相容 SSE（`stream: true`）：
+        回傳 (完整原文, completion_tokens, finish_reason, 是否因重複而中斷)。"""
+        payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+        think = ThinkFilter()
+        parts: list[str] = []
+        tokens = 0
+        finish: str | None = None
+        tail = ""          # 最近的可見文字，供重複偵測
+        unchecked = 0      # 上次檢查後新增的可見字元數
+        degenerate = False
+        with self.client.stream("POST", f"{url}/chat/completions", json=payload) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                body = line[5:].strip()
+                if body == "[DONE]":
+                    break
+                data = json.loads(body)
+                if data.get("usage"):
+                    tokens = int(data["usage"].get("completion_tokens", 0))
+                choices = data.get("choices") or []
+                if choices and choices[0].get("finish_reason"):
+                    finish = choices[0]["finish_reason"]
+                piece = (choices[0].get("delta") or {}).get("content") if choices else None
+                if not piece:
+                    continue
+                parts.append(piece)
+                visible = think.feed(piece)
+                if visible:
+                    on_delta(visible)
+                    if self.repeat_guard:
+                        tail = (tail + visible)[-1024:]
+                        unchecked += len(visible)
+                        if unchecked >= 32:  # 每累積一小段才檢查一次，攤平成本
+                            unchecked = 0
+                            if repeating_tail(tail):
+                                # 離開 with 會關閉連線，llama-server 偵測到斷線即停止生成
+                                degenerate = True
+                                break
+        rest = think.flush()
+        if rest and not degenerate:
+            on_delta(rest)
+        # 沒回 usage 的 server（或提前中斷）：每個 delta 約為一個 token
+        return "".join(parts), tokens or len(parts), finish, degenerate
+
+
+# ── 行程共用的連線池與 client 登錄表 ──
+_http: httpx.Client | None = None
+_clients: dict[tuple[str, str], LLMClient] = {}
+_lock = threading.Lock()
+
+
+def _shared_http() -> httpx.Client:
+    global _http
+    if _http is None:
+        from ..core.config import settings
+
+        _http = httpx.Client(
+            timeout=httpx.Timeout(settings.llm_timeout, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=settings.llm_max_connections,
+                max_keepalive_connections=settings.llm_max_keepalive,
+                keepalive_expiry=settings.llm_keepalive_expiry,
+            ),
+        )
+    return _http
+
+
+def get_llm(base_url: str | None = None, model: str | None = None) -> LLMClient:
+    """取得共用的 LLMClient（同端點同模型只建一次，底層連線池全行程共用）。"""
+    from ..core.config import settings
+
+    key = (base_url or settings.summarize_url, model or settings.model)
+    with _lock:
+        llm = _clients.get(key)
+        if llm is None:
+            cache = None
+            if settings.enable_llm_cache:
+                from .cache import get_chat_cache
+
+                cache = get_chat_cache()
+            llm = _clients[key] = LLMClient(*key, client=_shared_http(), cache=cache,
+                                            retries=settings.llm_retries,
+                                            eject_seconds=settings.llm_eject_seconds,
+                                            cache_prompt=settings.cache_prompt,
+                                            repeat_guard=settings.repeat_guard)
+    return llm
+
+
+def close_llm_clients() -> None:
+    """關閉共用連線池（應用關閉時呼叫）。"""
+    global _http
+    with _lock:
+        _clients.clear()
+        if _http is not None:
+            _http.close()
+            _http = None
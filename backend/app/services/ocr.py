@@ -15,8 +15,8 @@ def _get_engine():
     return _engine
 
 
-def ocr_png(png_bytes: bytes) -> str:
-    """對 PNG bytes 做 OCR，依由上而下的順序組回純文字。失敗回空字串。"""
+def ocr_png(png_bytes: bytes) -> str | None:
+    """對 PNG bytes 做 OCR，依由上而下的順序組回純文字。沒有文字回空字串，OCR 失敗回 None。"""
     try:
         engine = _get_engine()
         out = engine(png_bytes)
@@ -30,4 +30,4 @@ def ocr_png(png_bytes: bytes) -> str:
                 lines.append(str(item[1]))
         return "\n".join(lines).strip()
     except Exception:  # noqa: BLE001  OCR 失敗不應中斷整條 pipeline
-        return ""
+        return None
@@ -1,74 +1,214 @@
 """核心編排：PDF → 擷取 → 分類 → 分段 → 摘要 → 翻譯 → 彙整 → 組裝結果。
 
+擷取到分段是逐頁串流的：每湊滿一段就開始推理，不等整份 PDF（含 OCR）讀完。
+
 以 generator 形式產出進度事件（dict），供 NDJSON 串流或背景任務消費。
-事件格式：{"type": "progress"|"result"|"error", "progress": int, "message": str, "data": ...}
+事件格式：{"type": "progress"|"result"|"error"|"delta", "progress": int, "message": str, "data": ...}
+stream_deltas=True 時另產出 delta 事件，data = {"index": 段落序號, "field": "summary"|"translated",
+"text": 新增片段}，供前端即時顯示生成中的文字；最終內容仍以 result 事件為準。
 """
 from __future__ import annotations
 
+import queue
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from typing import Iterator
 
 from ..core.config import Settings
 from . import textproc
-from .llm import LLMClient
+from .llm import get_llm
 from .summarize import Summarizer, parse_global
-from .translate import build_translator, to_iso
+from .translate import QwenTranslator, Translator, build_translator, to_iso
 
 
 def run_pipeline(pdf_path: str | Path, settings: Settings,
                  do_summary: bool = True, do_translate: bool = True,
                  do_wordcloud: bool = True, do_report: bool = True,
-                 doc_id: str | None = None) -> Iterator[dict]:
+                 doc_id: str | None = None, refresh: bool = False,
+                 stream_deltas: bool = False, digest: str | None = None) -> Iterator[dict]:
+    """digest 為 PDF 內容 hash：有給時逐頁擷取/OCR 結果寫入並重用頁面快取（pages.db）。"""
     fix = textproc.to_traditional if settings.use_opencc else (lambda s: s)
 
     def ev(progress: int, message: str, type_: str = "progress", data=None) -> dict:
         return {"type": type_, "progress": progress, "message": message, "data": data}
 
+    # 工作執行緒產生的 delta 先進佇列，由本 generator 在等待結果時轉成事件送出
+    deltas: queue.Queue = queue.Queue()
+
+    def on_delta(index: int, field: str):
+        if not stream_deltas:
+            return None
+        return lambda text: deltas.put((index, field, text))
+
+    def wait(fut: Future, progress: int) -> Iterator[dict]:
+        while stream_deltas:
+            done = fut.done()  # 先取狀態再清佇列：完成前放入的 delta 都會在這輪送出
+            try:
+                index, field, text = deltas.get(block=not done, timeout=0.1)
+            except queue.Empty:
+                if done:
+                    return
+                continue
+            yield ev(progress, "", "delta", {"index": index, "field": field, "text": fix(text)})
+
+    pool = ThreadPoolExecutor(max_workers=max(1, settings.pipeline_concurrency))
+    stop = threading.Event()
+    summarizer: Summarizer | None = None
+    translators: dict[str, Translator] = {}   # 段落來源語言 → 翻譯器（第一次遇到該語言的段落才建立）
     try:
-        yield ev(3, "開始擷取 PDF 文字（掃描頁自動 OCR）")
-        pages = textproc.extract_pages(pdf_path, ocr=settings.enable_ocr)
-        total_pages = len(pages)
-
-        meaningful = [
-            textproc.clean_page_text(p) for p in pages if textproc.is_meaningful_page(p)
-        ]
-        meaningful = [m for m in meaningful if m.strip()]
-        chunks = textproc.chunk_pages(meaningful, settings.max_chunk_chars)
-        yield ev(15, f"擷取完成：{total_pages} 頁 → 有效內容 {len(chunks)} 段")
-        if not chunks:
-            yield ev(100, "PDF 未擷取到有效文字（OCR 後仍無內容，可能是空白或非文字文件）", "error")
-            return
+        total_pages = textproc.page_count(pdf_path)
+        yield ev(3, f"開始擷取 PDF 文字（共 {total_pages} 頁，掃描頁自動 OCR）")
+        # 準備模型（摘要與 Qwen 翻譯共用行程內同一個 LLMClient 與連線池）
+        llm = get_llm(settings.summarize_url, settings.model)
+        if refresh:  # 強制重新分析：不讀逐次呼叫快取
+            llm = llm.fresh()
+        page_cache = None
+        if digest:
+            from .cache import get_page_cache
 
-        # 偵測來源語言：已是目標語言就不必翻譯（中文文件翻成中文只會空轉又失真）
-        from .keywords import detect_language
+            page_cache = get_page_cache()
+        count = llm.count_tokens if settings.chunk_tokenizer == "server" else textproc.estimate_tokens
+
+        # 擷取 → 分類 → 分段在背景執行緒以 generator 串起來：每確定一段就立刻送進推理池，
+        # 本 generator 依段落順序收割，CPU 端的擷取/OCR 與推理重疊進行。
+        read = 0
+        profiles: list[textproc.PageProfile] = []   # 有效頁的剖析結果（字元集計數），供語言判定
+        src_lang = ""
+        tr_llm = llm
+        skip_noted = False
+        # ("event", ev) | ("chunk", i, chunk, fs, ft, 已讀頁數, 是否合併模式) | ("end",) | ("error", e)
+        items: queue.Queue = queue.Queue()
+
+        def pages() -> Iterator[str]:
+            nonlocal read
+            for text in textproc.iter_pages(pdf_path, ocr=settings.enable_ocr,
+                                            workers=settings.extract_workers,
+                                            digest=digest, cache=page_cache):
+                if stop.is_set():
+                    return
+                read += 1
+                prof = textproc.profile_page(text)   # 一次掃描同時得到分類、清理結果與字元集計數
+                if prof.meaningful and prof.cleaned.strip():
+                    profiles.append(prof)
+                    yield prof.cleaned
+
+        def setup(first: str) -> None:
+            """第一段出現時建立摘要器並決定槽分配；翻譯與否逐段決定（見 translator_for）。"""
+            nonlocal src_lang, summarizer, tr_llm
+            from .keywords import detect_language
+
+            # 摘要的輸出比例依來源語言估算：以目前讀過的有效頁計數加總判定，不重掃文字
+            src_lang = detect_language(first, list(profiles))
+
+            # 槽親和性：這份文件的槽分成兩組（自 doc_id 決定的起點交錯），摘要與翻譯各用一組、
+            # 組內輪流分派。槽內連續請求的系統提示相同 → 前綴 KV cache 一直命中，
+            # 而逐段/逐窗口的平行請求仍能分散到多個槽，不會在單一槽排隊
+            sum_llm = tr_llm = llm
+            if settings.llm_slots > 0 and doc_id:
+                n = settings.llm_slots
+                base = zlib.crc32(doc_id.encode()) % n
+                sum_slots = [(base + k) % n for k in range(0, n, 2)]
+                tr_slots = [(base + k) % n for k in range(1, n, 2)] or sum_slots
+                sum_llm, tr_llm = llm.pinned(sum_slots), llm.pinned(tr_slots)
+            summarizer = Summarizer(sum_llm, settings.global_input_chars,
+                                    settings.pipeline_concurrency, lang=src_lang) if do_summary else None
 
-        src_lang = detect_language("\n".join(chunks))
-        if do_translate and src_lang == to_iso(settings.target_lang):
-            do_translate = False
-            yield ev(16, f"原文已是目標語言（{src_lang}），略過翻譯")
+        def translator_for(chunk: str) -> Translator | None:
+            """這一段的翻譯器；段落本身已是目標語言時回 None（中文翻成中文只會空轉又失真）。
 
-        # 準備模型（摘要與 Qwen 翻譯共用同一個 LLMClient）
-        llm = LLMClient(settings.summarize_url, settings.model)
-        summarizer = Summarizer(llm) if do_summary else None
-        translator = build_translator(settings, llm, src_lang) if do_translate else None
+            逐段判定：中文摘要 + 英文本文、或英文首頁 + 中文本文的文件，各段依自己的語言決定。
+            """
+            nonlocal skip_noted
+            if not do_translate:
+                return None
+            from .keywords import detect_language
+
+            lang = detect_language(chunk)
+            if lang == to_iso(settings.target_lang):
+                if not skip_noted:
+                    skip_noted = True
+                    items.put(("event", ev(16, f"已是目標語言（{lang}）的段落略過翻譯")))
+                return None
+            if lang not in translators:
+                translators[lang] = build_translator(settings, tr_llm, lang)
+            return translators[lang]
+
+        def both(i: int, chunk: str, translator: QwenTranslator):
+            got = translator.translate_with_summary(chunk)
+            if got is None:  # 段標解析失敗 → 退回分開的兩次呼叫
+                return (summarizer.summarize_chunk(chunk, on_delta=on_delta(i, "summary")),
+                        translator.translate(chunk, on_delta=on_delta(i, "translated")))
+            for field, res in zip(("summary", "translated"), got):
+                if cb := on_delta(i, field):  # 合併輸出不逐 token 串流，完成時整段送出
+                    cb(res.text)
+            return got
+
+        def submit(i: int, chunk: str) -> tuple[Future | None, Future | None, bool]:
+            # 逐段的摘要/翻譯彼此獨立：丟進固定大小的執行緒池，讓推理端點的多個槽同時工作
+            translator = translator_for(chunk)
+            # 合併模式：摘要 + Qwen 翻譯各段只送一次（每窗口一次請求同時回譯文與重點）
+            if settings.combine_summary_translate and summarizer and isinstance(translator, QwenTranslator):
+                return pool.submit(both, i, chunk, translator), None, True
+            return (
+                pool.submit(summarizer.summarize_chunk, chunk,
+                            on_delta=on_delta(i, "summary")) if summarizer else None,
+                pool.submit(translator.translate, chunk,
+                            on_delta=on_delta(i, "translated")) if translator else None,
+                False,
+            )
+
+        def produce() -> None:
+            try:
+                for i, chunk in enumerate(textproc.iter_chunks(pages(), settings.max_chunk_tokens, count)):
+                    if i == 0:
+                        setup(chunk)
+                    fs, ft, merged = submit(i, chunk)
+                    items.put(("chunk", i, chunk, fs, ft, read, merged))
+                items.put(("end",))
+            except Exception as e:  # noqa: BLE001  交給收割端轉成 error 事件
+                items.put(("error", e))
+
+        threading.Thread(target=produce, daemon=True).start()
 
-        n = len(chunks)
         segments: list[dict] = []
         chunk_summaries: list[str] = []
-
-        for i, chunk in enumerate(chunks):
+        # 收割時依段落順序等待，進度事件與 segments 的順序與逐段執行時一致
+        prog = 15
+        while True:
+            item = items.get()
+            if item[0] == "event":
+                yield item[1]
+                continue
+            if item[0] == "error":
+                raise item[1]
+            if item[0] == "end":
+                break
+            _, i, chunk, fs, ft, pages_read, merged = item
             seg: dict = {"index": i, "original": chunk}
-            if summarizer:
-                s = summarizer.summarize_chunk(chunk)
-                seg["summary"] = fix(s.text)
+            translated = None
+            if fs:
+                yield from wait(fs, prog)
+                summary = fs.result()
+                if merged:
+                    summary, translated = summary
+                seg["summary"] = fix(summary.text)
                 chunk_summaries.append(seg["summary"])
-            if translator:
-                t = translator.translate(chunk)
-                seg["translated"] = fix(t.text)
+            if ft:
+                yield from wait(ft, prog)
+                translated = ft.result()
+            if translated is not None:
+                seg["translated"] = fix(translated.text)
             segments.append(seg)
-            # 15% → 90% 之間依段數推進
-            prog = 15 + int(75 * (i + 1) / n)
-            yield ev(prog, f"完成第 {i + 1}/{n} 段")
+            # 15% → 90% 之間依已讀頁數推進（總段數要讀完才知道）
+            prog = max(prog, 15 + int(75 * pages_read / max(1, total_pages)))
+            yield ev(prog, f"完成第 {i + 1} 段（已讀 {pages_read}/{total_pages} 頁）")
+
+        if not segments:
+            yield ev(100, "PDF 未擷取到有效文字（OCR 後仍無內容，可能是空白或非文字文件）", "error")
+            return
+        yield ev(90, f"擷取完成：{total_pages} 頁 → 有效內容 {len(segments)} 段")
 
         global_summary = None
         if summarizer and chunk_summaries:
@@ -77,7 +217,12 @@ def run_pipeline(pdf_path: str | Path, settings: Settings,
             global_summary = parse_global(fix(g.text))
 
         # 關鍵字 + 文字雲（由原文擷取，純 CPU）
-        original_text = "\n".join(c for c in chunks)
+        original_text = "\n".join(seg["original"] for seg in segments)
+        # 第一段出現時只讀了開頭幾頁（例如中文摘要 + 英文本文），那次判定只用來決定要不要翻譯；
+        # 關鍵字斷詞與回報的語言以全部有效頁重新判定
+        from .keywords import detect_language
+
+        doc_lang = detect_language(original_text, profiles)
         keywords: list = []
         wordcloud_url = None
         if do_wordcloud:
@@ -85,13 +230,13 @@ def run_pipeline(pdf_path: str | Path, settings: Settings,
             from .wordcloud_gen import generate_wordcloud
 
             yield ev(93, "提取關鍵字並產生文字雲")
-            kw_pairs = extract_keywords(original_text)
+            kw_pairs = extract_keywords(original_text, lang=doc_lang)
             keywords = [w for w, _ in kw_pairs]
             wordcloud_url = generate_wordcloud(kw_pairs, settings.font_path)
 
         result = {
-            "language": src_lang,
-            "total_pages": total_pages,
+            "language": doc_lang,
+            "total_pages": read,   # 實際讀完的頁數（擷取結束才確定）
             "segments": segments,
             "global_summary": global_summary,
             "keywords": keywords,
@@ -112,3 +257,12 @@ def run_pipeline(pdf_path: str | Path, settings: Settings,
 
     except Exception as e:  # noqa: BLE001
         yield ev(100, f"處理失敗：{e}", "error")
+    finally:
+        # 失敗或串流中斷時停止擷取、不再送出尚未開始的請求
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        if summarizer:
+            summarizer.close()
+        for t in list(translators.values()):   # 擷取執行緒可能仍在建立翻譯器
+            if isinstance(t, QwenTranslator):
+                t.close()
@@ -2,6 +2,7 @@
 
 與 cache.py 不同：cache 依「內容 hash + 變體」去重運算；store 依 doc_id 記錄每次上傳，
 是使用者可見的歷史。存 volume（storage/documents.db），重啟不掉。
+結果本體壓縮存在 blobs.py 的內容定址儲存，這裡只記 hash；快取命中的紀錄與快取共用同一份 blob。
 """
 from __future__ import annotations
 
@@ -10,15 +11,19 @@ import sqlite3
 import time
 from pathlib import Path
 
+from .blobs import BlobStore, get_blobs
+from .db import connect
+
 
 class DocumentStore:
-    def __init__(self, db_path: str | Path):
+    def __init__(self, db_path: str | Path, blobs: BlobStore | None = None):
         self.db_path = str(db_path)
         Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.blobs = blobs or get_blobs()
         self._init()
 
     def _conn(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.db_path, timeout=10)
+        return connect(self.db_path)   # 本執行緒共用的長駐連線（WAL），見 db.py
 
     def _init(self) -> None:
         with self._conn() as c:
@@ -26,8 +31,20 @@ class DocumentStore:
                 "CREATE TABLE IF NOT EXISTS documents ("
                 "doc_id TEXT PRIMARY KEY, filename TEXT, created_at REAL, "
                 "status TEXT, total_pages INTEGER DEFAULT 0, "
-                "has_report INTEGER DEFAULT 0, result TEXT, error TEXT)"
+                "has_report INTEGER DEFAULT 0, result TEXT, error TEXT, result_hash TEXT)"
             )
+            cols = {r[1] for r in c.execute("PRAGMA table_info(documents)")}
+            if "result_hash" not in cols:
+                c.execute("ALTER TABLE documents ADD COLUMN result_hash TEXT")
+            # 舊版整份 JSON 存在 result 欄：搬進 blob 儲存、清空原欄位
+            legacy = c.execute(
+                "SELECT doc_id, result FROM documents WHERE result_hash IS NULL AND result IS NOT NULL"
+            ).fetchall()
+            for doc_id, text in legacy:
+                c.execute("UPDATE documents SET result=NULL, result_hash=? WHERE doc_id=?",
+                          (self.blobs.put(json.loads(text)), doc_id))
+        if legacy:  # 搬走大欄位後回收空間（VACUUM 不能在交易內執行）
+            self._conn().execute("VACUUM")
 
     def create(self, doc_id: str, filename: str) -> None:
         with self._conn() as c:
@@ -37,15 +54,17 @@ class DocumentStore:
                 (doc_id, filename, time.time(), "processing"),
             )
 
-    def finish(self, doc_id: str, result: dict) -> None:
+    def finish(self, doc_id: str, result: dict, result_hash: str | None = None) -> None:
+        """標記完成；result_hash 為已存入 blob 的同一份結果時直接引用，不再序列化/壓縮一次。"""
+        ref = result_hash or self.blobs.put(result)
         with self._conn() as c:
             c.execute(
-                "UPDATE documents SET status='done', total_pages=?, has_report=?, result=? "
+                "UPDATE documents SET status='done', total_pages=?, has_report=?, result_hash=? "
                 "WHERE doc_id=?",
                 (
                     int(result.get("total_pages", 0)),
                     1 if result.get("report_pdf_url") else 0,
-                    json.dumps(result, ensure_ascii=False),
+                    ref,
                     doc_id,
                 ),
             )
@@ -57,27 +76,42 @@ class DocumentStore:
                 (error, doc_id),
             )
 
-    def get(self, doc_id: str) -> dict | None:
+    def get(self, doc_id: str, with_result: bool = True) -> dict | None:
+        """取一筆紀錄；with_result=False 時不載入結果本體（只需狀態或 result_hash 時）。"""
         with self._conn() as c:
-            c.row_factory = sqlite3.Row
-            row = c.execute("SELECT * FROM documents WHERE doc_id=?", (doc_id,)).fetchone()
+            cur = c.cursor()
+            cur.row_factory = sqlite3.Row   # 設在 cursor 上：連線是本執行緒共用的
+            row = cur.execute("SELECT * FROM documents WHERE doc_id=?", (doc_id,)).fetchone()
         if not row:
             return None
         d = dict(row)
-        d["result"] = json.loads(d["result"]) if d["result"] else None
+        d["result"] = self.blobs.get(d["result_hash"]) if with_result and d["result_hash"] else None
         return d
 
     def list(self, limit: int = 200) -> list[dict]:
         """歷史清單（不含笨重的 result 欄位）。"""
         with self._conn() as c:
-            c.row_factory = sqlite3.Row
-            rows = c.execute(
+            cur = c.cursor()
+            cur.row_factory = sqlite3.Row
+            rows = cur.execute(
                 "SELECT doc_id, filename, created_at, status, total_pages, has_report, error "
                 "FROM documents ORDER BY created_at DESC LIMIT ?",
                 (limit,),
             ).fetchall()
         return [dict(r) for r in rows]
 
+    def ids(self) -> set[str]:
+        with self._conn() as c:
+            return {r[0] for r in c.execute("SELECT doc_id FROM documents")}
+
+    def refs(self) -> set[str]:
+        """歷史紀錄引用到的所有結果 blob hash。"""
+        with self._conn() as c:
+            rows = c.execute(
+                "SELECT DISTINCT result_hash FROM documents WHERE result_hash IS NOT NULL"
+            ).fetchall()
+        return {r[0] for r in rows}
+
     def delete(self, doc_id: str) -> bool:
         with self._conn() as c:
             cur = c.execute("DELETE FROM documents WHERE doc_id=?", (doc_id,))
@@ -2,29 +2,98 @@
 from __future__ import annotations
 
 import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 
+from .budget import get_budget
 from .llm import ChatResult, LLMClient
+from .textproc import estimate_tokens
+
+
+# 系統提示固定為模組常數：所有請求的前綴逐位元組相同，推理端點才能重用 KV cache（cache_prompt）
+_CHUNK_SYSTEM = (
+    "你是專業的技術文件摘要助手。請用**正體中文（繁體）**，"
+    "以條列方式精煉重點，忠於原文、不杜撰，不要加入開場白。"
+)
+_CONDENSE_SYSTEM = (
+    "你是專業的技術文件摘要助手。請用**正體中文（繁體）**，"
+    "將連續幾段的分段摘要合併為一份精簡條列重點，保留結論、關鍵數據、風險與建議，"
+    "去除重複，忠於原文、不杜撰，不要加入開場白。"
+)
+_GLOBAL_SYSTEM = (
+    "你是專業的技術文件摘要助手。請用**正體中文（繁體）**，"
+    "將多段分頁摘要彙整為四個面向：結論、關鍵數據、風險/限制、行動建議。"
+    "以標題 + 條列呈現，忠於原文、不杜撰。"
+)
 
 
 class Summarizer:
-    def __init__(self, llm: LLMClient):
+    """逐段摘要 + 全局彙整。
+
+    逐段摘要的 max_tokens 依輸入 token 數與來源語言（lang）實測的輸出比例決定（見 budget.py）。
+
+    全局彙整採階層式 map-reduce：各段摘要串起來超過 global_input_chars 時，先分批濃縮
+    （批次間平行，用建構時建立的執行緒池，close() 釋放），再遞迴直到一次放得下，
+    最後才產生四象限輸出，避免長文件撐爆小模型的 context。
+    """
+
+    def __init__(self, llm: LLMClient, global_input_chars: int = 6000, concurrency: int = 4,
+                 max_levels: int = 4, lang: str = "en"):
         self.llm = llm
+        self.lang = lang
+        self.global_input_chars = global_input_chars
+        self.concurrency = max(1, concurrency)
+        self.max_levels = max_levels
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="summarize")
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def summarize_chunk(self, text: str, max_tokens: int | None = None,
+                        on_delta: Callable[[str], None] | None = None) -> ChatResult:
+        user = f"請摘要以下內容的重點：\n\n{text}"
+        return get_budget().generate(
+            "summary", self.lang, estimate_tokens(text),
+            lambda n, cb: self.llm.chat(_CHUNK_SYSTEM, user, n, on_delta=cb),
+            on_delta=on_delta, max_tokens=max_tokens)
+
+    @staticmethod
+    def _join(summaries: list[str]) -> str:
+        return "\n\n".join(f"[段落 {i + 1}]\n{s}" for i, s in enumerate(summaries))
+
+    def _batches(self, summaries: list[str]) -> list[list[str]]:
+        """依序把摘要聚成串接後不超過 global_input_chars 的批次（單段超長則自成一批）。"""
+        out: list[list[str]] = []
+        size = 0
+        for s in summaries:
+            cost = len(s) + 12  # 「[段落 n]」標頭與分隔
+            if out and size + cost <= self.global_input_chars:
+                out[-1].append(s)
+                size += cost
+            else:
+                out.append([s])
+                size = cost
+        return out
 
-    def summarize_chunk(self, text: str, max_tokens: int = 900) -> ChatResult:
-        system = (
-            "你是專業的技術文件摘要助手。請用**正體中文（繁體）**，"
-            "以條列方式精煉重點，忠於原文、不杜撰，不要加入開場白。"
-        )
-        return self.llm.chat(system, f"請摘要以下內容的重點：\n\n{text}", max_tokens)
+    def _condense(self, batch: list[str], max_tokens: int = 900) -> ChatResult:
+        return self.llm.chat(_CONDENSE_SYSTEM, f"請合併以下段落摘要的重點：\n\n{self._join(batch)}", max_tokens)
 
     def summarize_global(self, chunk_summaries: list[str], max_tokens: int = 1400) -> ChatResult:
-        system = (
-            "你是專業的技術文件摘要助手。請用**正體中文（繁體）**，"
-            "將多段分頁摘要彙整為四個面向：結論、關鍵數據、風險/限制、行動建議。"
-            "以標題 + 條列呈現，忠於原文、不杜撰。"
-        )
-        joined = "\n\n".join(f"[段落 {i + 1}]\n{s}" for i, s in enumerate(chunk_summaries))
-        return self.llm.chat(system, f"以下是各段落摘要，請彙整成全局重點：\n\n{joined}", max_tokens)
+        summaries = list(chunk_summaries)
+        elapsed = 0.0
+        tokens = 0
+        level = 0
+        while len(self._join(summaries)) > self.global_input_chars and level < self.max_levels:
+            batches = self._batches(summaries)
+            results = list(self._pool.map(self._condense, batches))
+            summaries = [r.text for r in results]
+            elapsed += sum(r.elapsed for r in results)
+            tokens += sum(r.completion_tokens for r in results)
+            level += 1
+        # 層數用盡仍過長（極端情況）：截斷輸入而不是讓 server 端默默截掉
+        joined = self._join(summaries)[:self.global_input_chars]
+        res = self.llm.chat(_GLOBAL_SYSTEM, f"以下是各段落摘要，請彙整成全局重點：\n\n{joined}", max_tokens)
+        return ChatResult(res.text, elapsed + res.elapsed, tokens + res.completion_tokens, res.cached)
 
 
 # 四象限切分：只認「標題行」為段界（化簡後剛好等於象限標題），內文的關鍵字不會誤判。
@@ -0,0 +1,116 @@
+"""儲存回收：定期淘汰結果快取並清掉不再需要的檔案，取代整個清空的手動清理。
+
+每輪依序：
+1. 結果快取依 TTL / 筆數 / 總位元組淘汰（LRU，見 cache.py）
+2. LLM 呼叫快取、逐頁擷取/OCR 快取依 TTL / 筆數淘汰
+3. 快取與歷史紀錄都不再引用的結果 blob（含段落）
+4. 分析完且超過保留時數的上傳 PDF（排隊或分析中的不動），以及中斷的上傳暫存檔
+5. 對應歷史紀錄已不存在的 PDF 報告
+6. 閒置過久的可續傳上傳工作階段
+
+所有刪除都留一段寬限（_GRACE），剛寫入、還沒被引用的檔案與 blob 不會被誤刪。
+"""
+from __future__ import annotations
+
+import threading
+import time
+from pathlib import Path
+
+from ..core.config import Settings
+
+_GRACE = 3600   # 秒
+
+
+def _prune_files(directory: Path, keep: set[str], older_than: float, pattern: str = "*.pdf") -> int:
+    """刪除 directory 下符合 pattern、檔名（不含副檔名）不在 keep、修改時間早於 older_than 的檔案。"""
+    removed = 0
+    for path in directory.glob(pattern):
+        if path.stem in keep:
+            continue
+        try:
+            if path.stat().st_mtime < older_than:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:  # 同時被刪除（例如 DELETE /documents）
+            pass
+    return removed
+
+
+def sweep(settings: Settings) -> dict:
+    """執行一輪回收，回傳本輪各類刪除數。"""
+    from .blobs import get_blobs
+    from .cache import get_cache, get_chat_cache, get_page_cache
+    from .jobs import manager
+    from .store import get_store
+    from .uploads import get_uploads
+
+    now = time.time()
+    cache, store = get_cache(), get_store()
+    out = {
+        "cache_evicted": cache.evict(
+            max_bytes=settings.result_cache_max_mb * 1024 * 1024,
+            max_entries=settings.result_cache_max_entries,
+            ttl=settings.result_cache_ttl_days * 86400,
+        ),
+    }
+    out["llm_cache"] = get_chat_cache().evict(settings.llm_cache_max_entries,
+                                              settings.llm_cache_ttl_days * 86400)
+    out["page_cache"] = get_page_cache().evict(settings.page_cache_max_entries,
+                                               settings.page_cache_ttl_days * 86400)
+    out["blobs"] = get_blobs().prune(cache.refs() | store.refs(), now - _GRACE)
+    out["uploads"] = _prune_files(
+        settings.storage_dir / "uploads", manager.active_digests(),
+        now - max(_GRACE, settings.upload_retention_hours * 3600))
+    # 上傳中途崩潰留下的暫存檔（寫入中的檔案修改時間持續更新，不會落在寬限期外）
+    out["upload_temp"] = _prune_files(settings.storage_dir / "uploads", set(), now - _GRACE, "*.part")
+    out["reports"] = _prune_files(settings.storage_dir / "reports", store.ids(), now - _GRACE)
+    out["upload_sessions"] = get_uploads().sweep(settings.upload_session_hours * 3600)
+    return out
+
+
+class Sweeper:
+    """背景執行緒，每 interval 秒跑一次 sweep()；累計各類刪除數供 /healthz 顯示。"""
+
+    def __init__(self, settings: Settings, interval: float):
+        self.settings = settings
+        self.interval = interval
+        self.totals: dict[str, int] = {}
+        self.last_run: float | None = None
+        self.last_error: str | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                for name, n in sweep(self.settings).items():
+                    self.totals[name] = self.totals.get(name, 0) + n
+                self.last_error = None
+            except Exception as e:  # noqa: BLE001  單輪失敗不中止回收執行緒，錯誤見 /healthz
+                self.last_error = str(e)
+            self.last_run = time.time()
+            self._stop.wait(self.interval)
+
+    def stats(self) -> dict:
+        return {"interval": self.interval, "last_run": self.last_run,
+                "last_error": self.last_error, "removed": dict(self.totals)}
+
+
+_sweeper: Sweeper | None = None
+
+
+def get_sweeper() -> Sweeper:
+    global _sweeper
+    if _sweeper is None:
+        from ..core.config import settings
+
+        _sweeper = Sweeper(settings, settings.sweep_interval)
+    return _sweeper
@@ -1,8 +1,19 @@
 """純文字處理：PDF 擷取、分段、斷句、頁面分類、OpenCC 繁體保底（皆不需 AI）。"""
 from __future__ import annotations
 
+import hashlib
+import math
+import multiprocessing
 import re
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
+
+if TYPE_CHECKING:
+    from .cache import PageCache
 
 # ── OpenCC s2t 繁體保底（延遲載入單例）──
 _OPENCC = None
@@ -18,25 +29,158 @@ def to_traditional(text: str) -> str:
 
 
 # ── PDF 擷取（含掃描頁 OCR fallback）──
-def extract_pages(pdf_path: str | Path, ocr: bool = True,
-                  ocr_min_chars: int = 40, ocr_dpi: int = 200) -> list[str]:
-    """逐頁抽文字；某頁文字量過少（掃描/圖片頁）時 render 成圖用 RapidOCR 補。"""
+def page_count(pdf_path: str | Path) -> int:
+    """只讀目錄結構取得頁數（不擷取內容），供逐頁串流時計算進度。"""
     import fitz  # PyMuPDF
 
-    doc = fitz.open(pdf_path)
-    pages: list[str] = []
-    for page in doc:
-        text = page.get_text("text").strip()
-        if ocr and len(text) < ocr_min_chars:
-            from .ocr import ocr_png
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+
+def _page_text(page, ocr: bool, ocr_min_chars: int, ocr_dpi: int,
+               ocr_cache: PageCache | None = None) -> str | None:
+    """單頁文字；OCR 失敗且文字層也是空的時回 None（結果不可信，不寫入頁面快取）。"""
+    text = page.get_text("text").strip()
+    if ocr and len(text) < ocr_min_chars:
+        from .ocr import ocr_png
 
-            png = page.get_pixmap(dpi=ocr_dpi).tobytes("png")
+        png = page.get_pixmap(dpi=ocr_dpi).tobytes("png")
+        image_hash = hashlib.sha256(png).hexdigest() if ocr_cache is not None else ""
+        ocr_text = ocr_cache.get_ocr(image_hash) if ocr_cache is not None else None
+        if ocr_text is None:
             ocr_text = ocr_png(png)
-            if len(ocr_text) > len(text):
-                text = ocr_text
-        pages.append(text)
-    doc.close()
-    return pages
+            if ocr_text is None:  # OCR 失敗：不快取，下次重試
+                return text or None
+            if ocr_cache is not None:   # 空字串也快取：確定沒有文字的空白頁
+                ocr_cache.put_ocr(image_hash, ocr_text)
+        if len(ocr_text) > len(text):
+            text = ocr_text
+    return text
+
+
+def _iter_range(pdf_path: str, start: int, stop: int, ocr: bool, ocr_min_chars: int,
+                ocr_dpi: int, ocr_db: str | None = None) -> Iterator[str | None]:
+    import fitz  # PyMuPDF
+
+    ocr_cache = None
+    if ocr and ocr_db:
+        from .cache import PageCache
+
+        ocr_cache = PageCache(ocr_db)
+    with fitz.open(pdf_path) as doc:
+        for k in range(start, stop):
+            yield _page_text(doc[k], ocr, ocr_min_chars, ocr_dpi, ocr_cache)
+
+
+def _extract_range(pdf_path: str, start: int, stop: int, ocr: bool, ocr_min_chars: int,
+                   ocr_dpi: int, ocr_db: str | None = None) -> list[str | None]:
+    """行程池的工作函式：自行開檔（PyMuPDF 文件物件不能跨行程傳遞），擷取 [start, stop) 頁。"""
+    return list(_iter_range(pdf_path, start, stop, ocr, ocr_min_chars, ocr_dpi, ocr_db))
+
+
+# 擷取/OCR 行程池（行程共用、延遲建立）：OCR 引擎在各工作行程內載入一次後常駐重用
+_procs: ProcessPoolExecutor | None = None
+_procs_lock = threading.Lock()
+
+
+def _extract_pool(workers: int) -> ProcessPoolExecutor:
+    global _procs
+    with _procs_lock:
+        if _procs is None:
+            # spawn：gateway 本身有多條執行緒與連線池，fork 出來的子行程可能卡在被複製的鎖上
+            _procs = ProcessPoolExecutor(max_workers=workers,
+                                         mp_context=multiprocessing.get_context("spawn"))
+        return _procs
+
+
+def close_extract_pool() -> None:
+    """關閉擷取行程池（應用關閉時呼叫）。"""
+    global _procs
+    with _procs_lock:
+        if _procs is not None:
+            _procs.shutdown(wait=False, cancel_futures=True)
+            _procs = None
+
+
+def iter_pages(pdf_path: str | Path, ocr: bool = True, ocr_min_chars: int = 40,
+               ocr_dpi: int = 200, workers: int = 1, batch: int = 8,
+               digest: str | None = None, cache: PageCache | None = None) -> Iterator[str]:
+    """逐頁產出文字；某頁文字量過少（掃描/圖片頁）時 render 成圖用 RapidOCR 補。
+
+    generator：每抽完一頁就交出去，下游（分類 → 分段 → 推理）不必等整份文件讀完。
+    workers > 1 且有不只一批頁面要擷取時，每 batch 頁為一個範圍分給行程池平行擷取（OCR 吃滿多核），
+    仍依頁序產出；同時在途的範圍限制在 workers 的兩倍，大檔不會一次佔滿整個池。
+    給 cache 時：有 digest 的頁面文字整批重用/寫回，OCR 另依頁面影像 hash 重用。
+    """
+    n = page_count(pdf_path)
+    variant = f"ocr:{ocr_min_chars}:{ocr_dpi}" if ocr else "text"
+    known = cache.get_pages(digest, variant) if cache is not None and digest else {}
+    ocr_db = cache.db_path if cache is not None else None
+    ranges = [(s, min(n, s + batch)) for s in range(0, n, batch)]
+
+    def cached(start: int, stop: int) -> list[str] | None:
+        if all(k in known for k in range(start, stop)):
+            return [known[k] for k in range(start, stop)]
+        return None
+
+    def save(start: int, texts: list[str | None]) -> None:
+        # 空白頁（空字串）照樣寫入，整個範圍下次才能直接命中；
+        # None 是 OCR 失敗，不寫入，下次該範圍重新擷取（其他頁仍命中 OCR 快取）
+        if cache is not None and digest:
+            cache.put_pages(digest, variant,
+                            {start + k: t for k, t in enumerate(texts) if t is not None})
+
+    todo = sum(1 for s, e in ranges if cached(s, e) is None)
+    if workers <= 1 or todo <= 1:
+        for start, stop in ranges:
+            hit = cached(start, stop)
+            if hit is not None:
+                yield from hit
+                continue
+            texts: list[str | None] = []
+            for text in _iter_range(str(pdf_path), start, stop, ocr, ocr_min_chars, ocr_dpi, ocr_db):
+                texts.append(text)
+                yield text or ""
+            save(start, texts)
+        return
+
+    pool = _extract_pool(workers)
+    pending = iter(ranges)
+    inflight: deque[tuple[int, Future | list[str]]] = deque()
+
+    def refill() -> None:
+        while len(inflight) < 2 * workers:
+            r = next(pending, None)
+            if r is None:
+                return
+            start, stop = r
+            hit = cached(start, stop)
+            inflight.append((start, hit if hit is not None else pool.submit(
+                _extract_range, str(pdf_path), start, stop, ocr, ocr_min_chars, ocr_dpi, ocr_db)))
+
+    try:
+        refill()
+        while inflight:
+            start, item = inflight.popleft()
+            if isinstance(item, Future):
+                texts = item.result()
+                save(start, texts)
+            else:
+                texts = item
+            refill()
+            yield from (t or "" for t in texts)
+    finally:  # 下游提前停止時取消尚未開始的範圍
+        for _, item in inflight:
+            if isinstance(item, Future):
+                item.cancel()
+
+
+def extract_pages(pdf_path: str | Path, ocr: bool = True, ocr_min_chars: int = 40,
+                  ocr_dpi: int = 200, workers: int = 1, digest: str | None = None,
+                  cache: PageCache | None = None) -> list[str]:
+    """一次取回全部頁面文字（iter_pages 的清單版）。"""
+    return list(iter_pages(pdf_path, ocr, ocr_min_chars, ocr_dpi, workers,
+                           digest=digest, cache=cache))
 
 
 # ── 頁面分類 / 文字清理：濾掉封面、目錄、參考文獻、圖表碎片頁 ──
@@ -51,21 +195,128 @@ _PAGE_NUM = re.compile(r"^\s*\d+\s*$")                    # 純頁碼行
 
 # CJK（中日韓）字元：這些語言不以空白斷詞，長度判斷必須逐字計
 _CJK = re.compile(r"[㐀-䶿一-鿿豈-﫿぀-ヿ가-힯]")
+_CJK_8 = re.compile(r"(?:[^㐀-䶿一-鿿豈-﫿぀-ヿ가-힯]*[㐀-䶿一-鿿豈-﫿぀-ヿ가-힯]){8}")   # 至少 8 個 CJK 字元
+
+
+# ── 字元集計數（查表）：每個不同字元只分類一次，之後查 dict；計數本身交給 C 實作的 Counter ──
+_SPACE, _OTHER, _HAN, _KANA, _HANGUL, _JAMO = range(6)   # 漢字、假名、諺文音節（皆屬 CJK）；諺文字母
+_N_CLASSES = 6
+_CHAR_CLASS: dict[str, int] = {}
+
+
+def _classify(ch: str) -> int:
+    o = ord(ch)
+    if 0x3400 <= o <= 0x4DBF or 0x4E00 <= o <= 0x9FFF or 0xF900 <= o <= 0xFAFF:
+        cls = _HAN
+    elif 0x3040 <= o <= 0x30FF:
+        cls = _KANA
+    elif 0xAC00 <= o <= 0xD7AF:
+        cls = _HANGUL
+    elif 0x1100 <= o <= 0x11FF:
+        cls = _JAMO
+    elif ch.isspace():
+        cls = _SPACE
+    else:
+        cls = _OTHER
+    _CHAR_CLASS[ch] = cls
+    return cls
+
+
+def _class_counts(text: str) -> list[int]:
+    counts = [0] * _N_CLASSES
+    get = _CHAR_CLASS.get
+    for ch, n in Counter(text).items():
+        cls = get(ch)
+        counts[_classify(ch) if cls is None else cls] += n
+    return counts
+
+
+@dataclass
+class PageProfile:
+    """單頁的一次性剖析結果：字元集計數、行分類與清理後文字，後續各階段共用、不再重掃。"""
+    dense: int = 0            # 非空白字元數
+    han: int = 0
+    kana: int = 0
+    hangul: int = 0           # 含諺文字母
+    cjk: int = 0              # 漢字 + 假名 + 諺文音節
+    meaningful: bool = False
+    cleaned: str = ""
+
+    @property
+    def cjk_ratio(self) -> float:
+        return self.cjk / self.dense if self.dense else 0.0
+
+    @property
+    def language(self) -> str | None:
+        return _script_of(self.han, self.kana, self.hangul, self.dense)
+
+
+def _script_of(han: int, kana: int, hangul: int, dense: int) -> str | None:
+    if not dense:
+        return None
+    if kana / dense >= 0.02:                       # 有假名即為日文（日文必然夾雜假名）
+        return "ja"
+    if hangul > han and hangul / dense >= 0.05:
+        return "ko"
+    if han / dense >= 0.05:
+        return "zh"
+    return None
 
 
-_HAN = re.compile(r"[㐀-䶿一-鿿豈-﫿]")   # 漢字（中文／日文漢字）
-_KANA = re.compile(r"[぀-ヿ]")                            # 假名（日文專屬）
-_HANGUL = re.compile(r"[가-힯ᄀ-ᇿ]")             # 諺文（韓文專屬）
+def profile_page(text: str) -> PageProfile:
+    """單次剖析一頁：整頁字元集計數一次、逐行分出垃圾行/內容行/成句行，並判定有效性與清理結果。
+
+    有效頁需：夠長、非參考/目錄標題、且含足夠成句內容（濾掉圖表/公式碎片頁）。
+    清理時去掉目錄點引線、純頁碼、參考文獻條目與零碎短行；CJK 版面常把一句話拆成數個短行
+    （也常以短行承載標題與欄位），只留「成句」的行會把大半內容丟掉，故中日韓頁面僅濾明確垃圾行。
+    """
+    stripped = text.strip()
+    lines = stripped.splitlines()
+    totals = _class_counts(stripped)
+    content: list[str] = []   # 去掉明確垃圾行（純頁碼、目錄點引線、參考文獻條目、單字元殘渣）
+    prose: list[str] = []     # 其中看起來像「句子」的行
+    for line in lines:
+        s = line.strip()
+        if len(s) < 2 or _PAGE_NUM.match(s) or _TOC_LEADER.match(s) or _REF_ENTRY.match(s):
+            continue
+        content.append(s)
+        # 語言無關的「成句」判斷：拉丁語系按空白斷詞（≥5 詞），CJK 逐字計（≥8 字）；
+        # 頁面沒有 CJK 字元時整頁都不必逐字計
+        if len(s.split()) >= 5 or (totals[_HAN] + totals[_KANA] + totals[_HANGUL]
+                                   and len(s) >= 8 and _CJK_8.search(s)):
+            prose.append(s)
+
+    dense = sum(totals) - totals[_SPACE]
+    prof = PageProfile(dense=dense, han=totals[_HAN], kana=totals[_KANA],
+                       hangul=totals[_HANGUL] + totals[_JAMO],
+                       cjk=totals[_HAN] + totals[_KANA] + totals[_HANGUL])
+    is_cjk = prof.cjk_ratio >= 0.2
+    prof.cleaned = "\n".join(content if is_cjk else prose)
+    # CJK 資訊密度高（一字一詞）且版面常把整句拆成短行，長度與成句比例兩道門檻都須放寬，
+    # 否則整份中文文件會被全數濾掉。
+    prof.meaningful = (
+        len(stripped) >= (60 if is_cjk else 120)
+        and not (lines and _SKIP_PATTERNS.match(lines[0]))
+        # 成句行太少（多為圖說/圖表 token/目錄），或成句內容佔比過低 → 視為無效
+        and len(prose) >= 3
+        and len(" ".join(prose)) >= len(stripped) * (0.2 if is_cjk else 0.35)
+    )
+    return prof
 
 
-def _dense_len(text: str) -> int:
-    return sum(1 for c in text if not c.isspace())
+def profiles_language(profiles: Iterable[PageProfile]) -> str | None:
+    """由各頁計數加總判斷整份文件的 CJK 語言（不必把全文串起來重掃）；判不出來回 None。"""
+    han = kana = hangul = dense = 0
+    for p in profiles:
+        han, kana, hangul, dense = han + p.han, kana + p.kana, hangul + p.hangul, dense + p.dense
+    return _script_of(han, kana, hangul, dense)
 
 
 def cjk_ratio(text: str) -> float:
     """CJK 字元佔非空白字元的比例，用來判斷是否為中日韓文件。"""
-    dense = _dense_len(text)
-    return len(_CJK.findall(text)) / dense if dense else 0.0
+    counts = _class_counts(text)
+    dense = sum(counts) - counts[_SPACE]
+    return (counts[_HAN] + counts[_KANA] + counts[_HANGUL]) / dense if dense else 0.0
 
 
 def script_language(text: str) -> str | None:
@@ -74,94 +325,156 @@ def script_language(text: str) -> str | None:
     langdetect 對中英混排（技術文件、履歷）常誤判——實測把中文履歷判成 ko，
     使關鍵字走英文分支、jieba 完全沒被呼叫。字元集判斷是確定性的，故優先採用。
     """
-    dense = _dense_len(text)
-    if not dense:
-        return None
-    han = len(_HAN.findall(text))
-    kana = len(_KANA.findall(text))
-    hangul = len(_HANGUL.findall(text))
-    if kana / dense >= 0.02:                       # 有假名即為日文（日文必然夾雜假名）
-        return "ja"
-    if hangul > han and hangul / dense >= 0.05:
-        return "ko"
-    if han / dense >= 0.05:
-        return "zh"
-    return None
+    counts = _class_counts(text)
+    return _script_of(counts[_HAN], counts[_KANA], counts[_HANGUL] + counts[_JAMO],
+                      sum(counts) - counts[_SPACE])
 
 
-def _is_sentence_like(s: str) -> bool:
-    """語言無關的「成句」判斷：CJK 逐字計（≥8 字），拉丁語系按空白斷詞（≥5 詞）。"""
-    cjk = len(_CJK.findall(s))
-    if cjk >= 8:
-        return True
-    return len(s.split()) >= 5
+def is_meaningful_page(text: str) -> bool:
+    return profile_page(text).meaningful
 
 
-def _content_lines(text: str) -> list[str]:
-    """去掉明確的垃圾行（純頁碼、目錄點引線、參考文獻條目、單字元殘渣）。"""
-    out = []
-    for line in text.splitlines():
-        s = line.strip()
-        if not s or _PAGE_NUM.match(s) or _TOC_LEADER.match(s) or _REF_ENTRY.match(s):
-            continue
-        if len(s) < 2:
-            continue
-        out.append(s)
-    return out
+def clean_page_text(text: str) -> str:
+    return profile_page(text).cleaned
 
 
-def _prose_lines(text: str) -> list[str]:
-    """回傳看起來像「句子」的行（字數足夠、非碎片/目錄/參考）。"""
-    return [s for s in _content_lines(text) if _is_sentence_like(s)]
+# ── 分段（依估算 token 數） ──
+def estimate_tokens(text: str) -> int:
+    """依字元集估算 token 數：CJK 約一字一 token，其餘（拉丁字母、數字、符號）約四字元一 token。
 
+    同樣 6000 字元，中文的 token 數是英文的數倍；以 token 而非字元切段，各段推理時間才相近。
+    """
+    cjk = len(_CJK.findall(text))
+    return cjk + -(-(len(text) - cjk) // 4)
 
-def is_meaningful_page(text: str) -> bool:
-    """有效頁需：夠長、非參考/目錄標題、且含足夠成句內容（濾掉圖表/公式碎片頁）。"""
-    stripped = text.strip()
-    is_cjk = cjk_ratio(stripped) >= 0.2
-    # CJK 資訊密度高（一字一詞）且版面常把整句拆成短行，兩道門檻都須放寬，
-    # 否則整份中文文件會被全數濾掉。
-    if len(stripped) < (60 if is_cjk else 120):
-        return False
-    head = stripped.splitlines()[0] if stripped.splitlines() else ""
-    if _SKIP_PATTERNS.match(head):
-        return False
-    prose = _prose_lines(stripped)
-    # 成句行太少（多為圖說/圖表 token/目錄），或成句內容佔比過低 → 視為無效
-    if len(prose) < 3:
-        return False
-    if len(" ".join(prose)) < len(stripped) * (0.2 if is_cjk else 0.35):
-        return False
-    return True
 
+_CJK_SENT_END = re.compile(r"(?<=[。！？；])")   # 中日文句末標點後常不留空白，split_sentences 切不開
 
-def clean_page_text(text: str) -> str:
-    """去掉目錄點引線、純頁碼、參考文獻條目與零碎短行。
 
-    CJK 版面常把一句話拆成數個短行（也常以短行承載標題與欄位），
-    只留「成句」的行會把大半內容丟掉，故中日韓文件僅濾明確垃圾行。
+def _hard_split(text: str, size: int, count: Callable[[str], int]) -> list[str]:
+    """連單句都超過預算（表格、無標點長串）時，按估算比例直接切成約 size token 的小片。"""
+    n = -(-count(text) // max(1, size))
+    step = max(1, -(-len(text) // n))
+    return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+def _split_oversize(page: str, max_tokens: int, count: Callable[[str], int]) -> list[str]:
+    """把超過預算的單頁依段落（行）→ 句子 → 硬切的順序拆成各自不超過預算的片段。
+
+    硬切的片段取預算的 1/4，留給後續裝箱足夠的彈性把各段湊平均。
     """
-    lines = _content_lines(text) if cjk_ratio(text) >= 0.2 else _prose_lines(text)
-    return "\n".join(lines)
+    pieces: list[str] = []
+    for line in page.splitlines():
+        if not line.strip():
+            continue
+        if count(line) <= max_tokens:
+            pieces.append(line)
+            continue
+        for sent in split_sentences(line):
+            for part in (_CJK_SENT_END.split(sent) if count(sent) > max_tokens else [sent]):
+                if not part:
+                    continue
+                pieces.extend([part] if count(part) <= max_tokens
+                              else _hard_split(part, max_tokens // 4, count))
+    return pieces
 
 
-# ── 分段 ──
-def chunk_pages(pages: list[str], max_chars: int) -> list[str]:
-    chunks: list[str] = []
-    buf = ""
+def _scaled(page: str, tokens: int) -> Callable[[str], int]:
+    """以整頁的實際 token 數校正字元集估算，給同頁的片段使用（不再逐片呼叫 count）。"""
+    factor = tokens / max(1, estimate_tokens(page))
+    return lambda s: math.ceil(estimate_tokens(s) * factor)
+
+
+# 單位相接的分隔（"\n\n" 或 "\n"）約一個 token：算進每個單位，裝箱時段落總量才不會超出上限
+_SEP_TOKENS = 1
+
+
+def _units(pages: Iterable[str], max_tokens: int,
+           count: Callable[[str], int]) -> Iterator[tuple[str, int]]:
+    """頁面 → 裝箱單位 (文字, token 數)；超長的單頁先依段落/句界拆成小片。
+
+    count 每頁只呼叫一次（CHUNK_TOKENIZER=server 時是一次 /tokenize 往返）；
+    超長頁拆出的行/句/片段改用以該頁實際計數校正過的估算，不必每片都問一次 server。
+    token 數含與前一單位相接的分隔（_SEP_TOKENS；段首單位多算這一個，寧可保守）。
+    """
+    budget = max_tokens - _SEP_TOKENS
     for page in pages:
         if not page:
             continue
-        if buf and len(buf) + len(page) > max_chars:
-            chunks.append(buf)
-            buf = page
+        t = count(page)
+        if t <= budget:
+            yield page, t + _SEP_TOKENS
         else:
-            buf = f"{buf}\n\n{page}" if buf else page
+            local = _scaled(page, t)
+            # 同頁拆出的片段以單換行相接，維持原本的段內排版
+            for k, p in enumerate(_split_oversize(page, budget, local)):
+                yield (p if k == 0 else "\n" + p), local(p) + _SEP_TOKENS
+
+
+def _join_units(units: list[tuple[str, int]]) -> str:
+    out = ""
+    for text, _ in units:
+        sep = "" if text.startswith("\n") else "\n\n"
+        out = f"{out}{sep}{text}" if out else text.lstrip("\n")
+    return out
+
+
+def _pack(units: list[tuple[str, int]], max_tokens: int) -> list[str]:
+    """以「總量 ÷ 段數」為目標大小依序裝箱，各段不超過 max_tokens 且大小盡量平均。"""
+    if not units:
+        return []
+    remaining = sum(t for _, t in units)
+    n = -(-remaining // max_tokens)   # 最少段數
+    chunks: list[str] = []
+    buf: list[tuple[str, int]] = []
+    size = 0
+    for text, t in units:
+        # 目標 = 尚未收段的量 ÷ 尚餘段數（每收一段重算，前面多裝的由後面吸收）
+        target = remaining / max(1, n - len(chunks))
+        # 放進來會超過上限，或超過目標且放進來比不放離目標更遠 → 收段
+        if buf and (size + t > max_tokens or (size + t > target and size + t - target > target - size)):
+            chunks.append(_join_units(buf))
+            remaining -= size
+            buf, size = [], 0
+        buf.append((text, t))
+        size += t
     if buf:
-        chunks.append(buf)
+        chunks.append(_join_units(buf))
     return chunks
 
 
+def chunk_by_tokens(pages: list[str], max_tokens: int,
+                    count: Callable[[str], int] = estimate_tokens) -> list[str]:
+    """把頁面聚成不超過 max_tokens 的段落，且各段大小盡量平均。
+
+    避免最後一段只剩零頭——段落大小一致，逐段請求的延遲才可預期、平行時不會有長尾。
+    """
+    return _pack(list(_units(pages, max_tokens, count)), max_tokens)
+
+
+def iter_chunks(pages: Iterable[str], max_tokens: int,
+                count: Callable[[str], int] = estimate_tokens) -> Iterator[str]:
+    """chunk_by_tokens 的串流版：頁面邊讀邊分段，一段確定就立刻交出。
+
+    待裝箱的量超過兩段上限時，最前面的一段不論後面還有多少內容都不會再變，依序裝滿上限後送出；
+    文件讀完時剩下的（不到兩段）再以平均裝箱收尾，一樣不會留下零頭小段。
+    """
+    pending: list[tuple[str, int]] = []
+    size = 0
+    for unit in _units(pages, max_tokens, count):
+        pending.append(unit)
+        size += unit[1]
+        while size > 2 * max_tokens:
+            k, head = 0, 0
+            while k < len(pending) and (k == 0 or head + pending[k][1] <= max_tokens):
+                head += pending[k][1]
+                k += 1
+            yield _join_units(pending[:k])
+            del pending[:k]
+            size -= head
+    yield from _pack(pending, max_tokens)
+
+
 _SENT_SPLIT = re.compile(r"(?<=[.!?。！？])\s+")
 
 
@@ -1,13 +1,17 @@
 """翻譯引擎：Qwen2.5 一模兩用（技術文，預設）／ NLLB-200（通用、多語）。"""
 from __future__ import annotations
 
+import re
+import threading
 import time
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Protocol
+from typing import Callable, Protocol
 
-from .llm import LLMClient
-from .textproc import split_sentences
+from .budget import get_budget
+from .llm import ChatResult, LLMClient
+from .textproc import estimate_tokens, split_sentences
 
 LANG_NAMES = {
     "zho_Hant": "正體中文（繁體）",
@@ -25,6 +29,10 @@ _NLLB_OF = {"zh": "zho_Hans", "en": "eng_Latn", "ja": "jpn_Jpan", "ko": "kor_Han
             "fr": "fra_Latn", "de": "deu_Latn", "es": "spa_Latn", "ru": "rus_Cyrl"}
 
 
+# 合併模式：一次請求同時回譯文與重點，以固定段標切開
+_COMBINED = re.compile(r"【譯文】\s*(?P<translation>.*?)\s*【重點】\s*(?P<summary>.*)", re.DOTALL)
+
+
 def to_iso(nllb_code: str) -> str:
     """把 NLLB 碼（zho_Hant）轉成 ISO 639-1（zh），無對應時回原字串前綴。"""
     prefix = nllb_code.split("_")[0]
@@ -39,23 +47,87 @@ def to_nllb(iso_code: str, default: str = "eng_Latn") -> str:
 @dataclass
 class TranslateResult:
     text: str
-    elapsed: float
+    elapsed: float                 # 各窗口推理耗時總和
     n_sentences: int = 0
     completion_tokens: int = 0
+    window_elapsed: list[float] = field(default_factory=list)   # 依窗口順序的單窗耗時
+    wall_elapsed: float = 0.0      # 實際經過時間（窗口平行時小於 elapsed）
 
 
 class Translator(Protocol):
-    def translate(self, text: str) -> TranslateResult: ...
+    def translate(self, text: str,
+                  on_delta: Callable[[str], None] | None = None) -> TranslateResult: ...
+
+
+class _OrderedRelay:
+    """平行窗口的 delta 依窗口順序轉送：目前窗口即時送出，後面的窗口先暫存，輪到時一次補送。"""
+
+    def __init__(self, on_delta: Callable[[str], None], n: int):
+        self.on_delta = on_delta
+        self.bufs: list[list[str]] = [[] for _ in range(n)]
+        self.done = [False] * n
+        self.cur = 0
+        self.lock = threading.Lock()
+
+    def sink(self, k: int) -> Callable[[str], None]:
+        def put(text: str) -> None:
+            with self.lock:
+                if k == self.cur:
+                    self.on_delta(text)
+                else:
+                    self.bufs[k].append(text)
+        return put
+
+    def finish(self, k: int) -> None:
+        with self.lock:
+            self.done[k] = True
+            while self.cur < len(self.done) and self.done[self.cur]:
+                self.cur += 1
+                if self.cur < len(self.done):
+                    self.on_delta("\n")  # 與最終 "\n".join(parts) 的窗口分隔一致
+                    for text in self.bufs[self.cur]:
+                        self.on_delta(text)
+                    self.bufs[self.cur].clear()
 
 
 class QwenTranslator:
-    """一模兩用：同一顆 Qwen 做翻譯。切成 ~窗口大小的小段逐段翻譯再合併，
-    避免整段長文丟給小模型時 echo 原文或被截斷（LLM 翻譯可靠性關鍵）。"""
+    """一模兩用：同一顆 Qwen 做翻譯。切成 ~窗口大小的小段翻譯再依序合併，
+    避免整段長文丟給小模型時 echo 原文或被截斷（LLM 翻譯可靠性關鍵）。
+
+    同一段的各窗口平行送出；concurrency 是整個 translator（跨段落）同時在途的窗口上限。
+    窗口交給 translator 自己的執行緒池（建構時建立、跨段落共用，close() 釋放），不逐段新建。
+    每個窗口的 max_tokens 依窗口 token 數與來源語言（src_lang）實測的譯文/原文比例決定。
+    """
 
-    def __init__(self, llm: LLMClient, tgt_lang: str = "zho_Hant", window_chars: int = 1400):
+    def __init__(self, llm: LLMClient, tgt_lang: str = "zho_Hant", window_chars: int = 1400,
+                 concurrency: int = 4, src_lang: str = "en"):
         self.llm = llm
+        self.src_lang = src_lang
         self.tgt_name = LANG_NAMES.get(tgt_lang, tgt_lang)
         self.window_chars = window_chars
+        self.concurrency = max(1, concurrency)
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="translate")
+        # 系統提示只在建構時組一次：每個窗口請求的前綴逐位元組相同，推理端點才能重用 KV cache
+        self._system = (
+            f"你是專業技術文件翻譯，將內容忠實譯成{self.tgt_name}。嚴格遵守：\n"
+            "1. 人名、作者名、機構名保留英文原樣，不翻譯也不音譯（例：Haoran Wei）。\n"
+            "2. 模型、演算法、專有名詞與縮寫保留原文，必要時中英並陳（例：DeepEncoder V2、LLM、VLMs）。\n"
+            f"3. 必須翻成{self.tgt_name}，禁止原封不動輸出原文；用詞精準、依上下文選正確詞義、術語前後一致。\n"
+            "4. 只輸出譯文本身，不要任何說明、開場白或標註。"
+        )
+        self._combined_system = (
+            "你是專業技術文件翻譯兼摘要助手。對使用者提供的內容，嚴格依下列格式輸出，不要任何其他文字：\n"
+            "【譯文】\n"
+            f"（將內容忠實譯成{self.tgt_name}；人名、機構名、模型與演算法名稱及縮寫保留原文，"
+            "禁止原封不動輸出原文。）\n"
+            "【重點】\n"
+            "（用**正體中文（繁體）**條列 1–5 點重點，忠於原文、不杜撰。）"
+        )
+
+    def close(self) -> None:
+        """釋放窗口執行緒池；尚未開始的窗口請求一併取消。"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
 
     def _windows(self, text: str) -> list[str]:
         """依句界把文字聚成不超過 window_chars 的小段。"""
@@ -71,23 +143,69 @@ class QwenTranslator:
             out.append(buf)
         return out or ([text] if text.strip() else [])
 
-    def translate(self, text: str) -> TranslateResult:
-        system = (
-            f"你是專業技術文件翻譯，將內容忠實譯成{self.tgt_name}。嚴格遵守：\n"
-            "1. 人名、作者名、機構名保留英文原樣，不翻譯也不音譯（例：Haoran Wei）。\n"
-            "2. 模型、演算法、專有名詞與縮寫保留原文，必要時中英並陳（例：DeepEncoder V2、LLM、VLMs）。\n"
-            f"3. 必須翻成{self.tgt_name}，禁止原封不動輸出原文；用詞精準、依上下文選正確詞義、術語前後一致。\n"
-            "4. 只輸出譯文本身，不要任何說明、開場白或標註。"
+    def _chat(self, task: str, system: str, w: str,
+              on_delta: Callable[[str], None] | None = None) -> ChatResult:
+        return get_budget().generate(
+            task, self.src_lang, estimate_tokens(w),
+            lambda n, cb: self.llm.chat(system, w, max_tokens=n, temperature=0.2, on_delta=cb),
+            on_delta=on_delta)
+
+    def translate(self, text: str,
+                  on_delta: Callable[[str], None] | None = None) -> TranslateResult:
+        windows = self._windows(text)
+        relay = _OrderedRelay(on_delta, len(windows)) if on_delta else None
+
+        def one(k: int, w: str) -> ChatResult:
+            with self._slots:
+                try:
+                    return self._chat("translate", self._system, w,
+                                      on_delta=relay.sink(k) if relay else None)
+                finally:
+                    if relay:
+                        relay.finish(k)
+
+        start = time.perf_counter()
+        if len(windows) <= 1:
+            results = [one(k, w) for k, w in enumerate(windows)]
+        else:
+            results = list(self._pool.map(one, range(len(windows)), windows))
+        return TranslateResult(
+            "\n".join(r.text for r in results),
+            sum(r.elapsed for r in results),
+            len(split_sentences(text)),
+            sum(r.completion_tokens for r in results),
+            window_elapsed=[r.elapsed for r in results],
+            wall_elapsed=time.perf_counter() - start,
+        )
+
+    def translate_with_summary(self, text: str) -> tuple[ChatResult, TranslateResult] | None:
+        """合併模式：每個窗口一次請求同時取得譯文與條列重點，原文只 prefill 一次。
+
+        回傳 (摘要, 翻譯)；任一窗口的輸出切不出兩個段標時回 None，由呼叫端退回分開的兩次呼叫。
+        """
+        windows = self._windows(text)
+
+        def one(w: str) -> ChatResult:
+            with self._slots:
+                return self._chat("combined", self._combined_system, w)
+
+        start = time.perf_counter()
+        if len(windows) <= 1:
+            results = [one(w) for w in windows]
+        else:
+            results = list(self._pool.map(one, windows))
+        parsed = [_COMBINED.search(r.text) for r in results]
+        if not results or not all(m and m["translation"] and m["summary"] for m in parsed):
+            return None
+        elapsed = sum(r.elapsed for r in results)
+        tokens = sum(r.completion_tokens for r in results)
+        summary = ChatResult("\n".join(m["summary"] for m in parsed), elapsed, tokens)
+        translation = TranslateResult(
+            "\n".join(m["translation"] for m in parsed), elapsed, len(split_sentences(text)), tokens,
+            window_elapsed=[r.elapsed for r in results],
+            wall_elapsed=time.perf_counter() - start,
         )
-        parts: list[str] = []
-        elapsed = 0.0
-        tokens = 0
-        for w in self._windows(text):
-            res = self.llm.chat(system, w, max_tokens=min(2048, len(w) + 500), temperature=0.2)
-            parts.append(res.text)
-            elapsed += res.elapsed
-            tokens += res.completion_tokens
-        return TranslateResult("\n".join(parts), elapsed, len(split_sentences(text)), tokens)
+        return summary, translation
 
 
 class NLLBTranslator:
@@ -104,11 +222,16 @@ class NLLBTranslator:
         self.tokenizer = transformers.AutoTokenizer.from_pretrained(tokenizer_src, src_lang=src_lang)
         self.translator = ctranslate2.Translator(ct2_dir, device=device, compute_type=compute_type)
 
-    def translate(self, text: str) -> TranslateResult:
+    def translate(self, text: str,
+                  on_delta: Callable[[str], None] | None = None) -> TranslateResult:
         sentences = split_sentences(text)
         start = time.perf_counter()
         out = self._translate_sentences(sentences)
-        return TranslateResult(" ".join(out), time.perf_counter() - start, len(sentences))
+        joined = " ".join(out)
+        if on_delta and joined:  # 句級批次翻譯沒有逐 token 輸出，整段一次送出
+            on_delta(joined)
+        elapsed = time.perf_counter() - start
+        return TranslateResult(joined, elapsed, len(sentences), wall_elapsed=elapsed)
 
     def _translate_sentences(self, sentences: list[str]) -> list[str]:
         if not sentences:
@@ -130,7 +253,8 @@ class NLLBTranslator:
 def build_translator(settings, llm: LLMClient, src_iso: str | None = None) -> Translator:
     """src_iso 為偵測到的來源語言（ISO 639-1）；未提供時退回 settings.src_lang。"""
     if settings.translator == "qwen":
-        return QwenTranslator(llm, settings.target_lang)
+        return QwenTranslator(llm, settings.target_lang, concurrency=settings.translate_concurrency,
+                              src_lang=src_iso or to_iso(settings.src_lang))
     src = to_nllb(src_iso, settings.src_lang) if src_iso else settings.src_lang
     return NLLBTranslator(
         settings.nllb_ct2_dir, settings.nllb_tokenizer, src,
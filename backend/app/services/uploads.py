@@ -0,0 +1,203 @@
+"""可續傳上傳：建立工作階段 → 分段 PUT 位元組範圍 → 查詢已收位移 → 完成。
+
+大型掃描 PDF 在不穩的網路上傳到一半失敗時，只需從伺服器回報的位移接著傳，不必整份重來。
+工作階段存在 storage/uploads/sessions/：{id}.part 為已收內容、{id}.json 為中繼資料，
+重啟後仍可續傳（已收位移 = .part 的大小）。SHA-256 隨收隨算，只有重啟後第一次續傳才需重讀已收部分。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+_BLOCK = 1024 * 1024
+
+
+class UploadError(Exception):
+    """上傳協定錯誤；status 對應回給客戶端的 HTTP 狀態碼。"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class UploadSession:
+    upload_id: str
+    filename: str
+    size: int                  # 宣告的總位元組數
+    offset: int = 0            # 已收且已納入 hasher 的位元組數
+    hasher: Any = field(default_factory=hashlib.sha256, repr=False)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def complete(self) -> bool:
+        return self.offset == self.size
+
+
+def store_stream(read: Callable[[int], bytes], upload_dir: Path, limit: int) -> tuple[str, Path]:
+    """把 read() 逐塊寫到暫存檔並同步累算 SHA-256，超過 limit 立即中止（UploadError 413）；
+    完成後原子地改名為 upload_dir/{digest}.pdf，同內容檔案已存在就不再寫一次。"""
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=upload_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while block := read(_BLOCK):
+                size += len(block)
+                if size > limit:
+                    raise UploadError(413, f"檔案超過 {limit // (1024 * 1024)}MB 上限")
+                h.update(block)
+                out.write(block)
+        if not size:
+            raise UploadError(400, "空檔案")
+        return _commit(Path(tmp), h.hexdigest()[:16], upload_dir)
+    finally:
+        Path(tmp).unlink(missing_ok=True)
+
+
+def _commit(tmp: Path, digest: str, upload_dir: Path) -> tuple[str, Path]:
+    path = upload_dir / f"{digest}.pdf"
+    try:
+        # 同內容檔已存在：更新修改時間，避免剛重傳的舊檔在排入分析前被 sweeper 當成過期刪掉
+        os.utime(path)
+    except FileNotFoundError:
+        os.replace(tmp, path)  # 同一檔案系統內 rename 為原子操作，讀者不會看到寫一半的檔
+    return digest, path
+
+
+class UploadManager:
+    def __init__(self, upload_dir: str | Path):
+        self.upload_dir = Path(upload_dir)
+        self.session_dir = self.upload_dir / "sessions"
+        self.session_dir.mkdir(parents=True, exist_ok=True)
+        self._sessions: dict[str, UploadSession] = {}
+        self._lock = threading.Lock()
+
+    def _part(self, upload_id: str) -> Path:
+        return self.session_dir / f"{upload_id}.part"
+
+    def _meta(self, upload_id: str) -> Path:
+        return self.session_dir / f"{upload_id}.json"
+
+    def create(self, filename: str, size: int) -> UploadSession:
+        sess = UploadSession(uuid.uuid4().hex, filename, size)
+        self._part(sess.upload_id).touch()
+        self._meta(sess.upload_id).write_text(
+            json.dumps({"filename": filename, "size": size}, ensure_ascii=False), encoding="utf-8")
+        with self._lock:
+            self._sessions[sess.upload_id] = sess
+        return sess
+
+    def get(self, upload_id: str) -> Optional[UploadSession]:
+        """取得工作階段；不在記憶體（例如重啟後）時由磁碟重建並重算已收部分的 hash。
+
+        重算可能要讀上百 MB，在全域鎖外進行，不擋其他工作階段；同時重建時以先放進去的為準。
+        """
+        if not upload_id.isalnum():  # upload_id 會拼進路徑
+            return None
+        with self._lock:
+            sess = self._sessions.get(upload_id)
+        if sess is not None:
+            return sess
+        meta, part = self._meta(upload_id), self._part(upload_id)
+        if not meta.exists() or not part.exists():
+            return None
+        info = json.loads(meta.read_text(encoding="utf-8"))
+        sess = UploadSession(upload_id, info["filename"], int(info["size"]))
+        with part.open("rb") as f:
+            while block := f.read(_BLOCK):
+                sess.hasher.update(block)
+                sess.offset += len(block)
+        with self._lock:
+            return self._sessions.setdefault(upload_id, sess)
+
+    @contextmanager
+    def append(self, sess: UploadSession, start: int,
+               length: int | None = None) -> Iterator[Callable[[bytes], None]]:
+        """從 start 位移接著寫入；回傳的 write(block) 逐塊附加並更新 hash 與位移。
+
+        同一工作階段同時只允許一個寫入者；start 必須等於目前已收位移，length 為這段宣告的長度。
+        寫到一半中斷時已寫入的部分保留，客戶端查詢位移後續傳即可；
+        區塊內丟出 UploadError（超過宣告長度、長度不符等）時整段作廢，位移與 hash 回到 start。
+        """
+        if not sess.lock.acquire(blocking=False):
+            raise UploadError(409, "此上傳正在接收另一段資料")
+        try:
+            if start != sess.offset:
+                raise UploadError(409, f"位移不符：伺服器已收 {sess.offset} bytes")
+            mark = sess.hasher.copy()
+            with self._part(sess.upload_id).open("ab") as out:
+                def write(block: bytes) -> None:
+                    if sess.offset + len(block) > sess.size:
+                        raise UploadError(413, f"超過宣告的檔案大小（{sess.size} bytes）")
+                    if length is not None and sess.offset + len(block) > start + length:
+                        raise UploadError(400, f"內容超過 Content-Range 宣告的 {length} bytes")
+                    out.write(block)
+                    sess.hasher.update(block)
+                    sess.offset += len(block)
+
+                try:
+                    yield write
+                except UploadError:
+                    out.flush()
+                    out.truncate(start)
+                    sess.hasher, sess.offset = mark, start
+                    raise
+        finally:
+            sess.lock.release()
+
+    def finalize(self, sess: UploadSession) -> tuple[str, Path]:
+        """全部收齊後移成 uploads/{digest}.pdf 並結束工作階段，回傳 (digest, path)。"""
+        with sess.lock:
+            if not sess.complete:
+                raise UploadError(409, f"尚未收齊：{sess.offset}/{sess.size} bytes")
+            digest, path = _commit(self._part(sess.upload_id), sess.hasher.hexdigest()[:16],
+                                   self.upload_dir)
+            self.discard(sess.upload_id)
+        return digest, path
+
+    def sweep(self, max_age: float) -> int:
+        """丟棄超過 max_age 秒沒有新資料的工作階段（以 .part 修改時間判斷），回傳丟棄數。"""
+        cutoff = time.time() - max_age
+        removed = 0
+        for meta in self.session_dir.glob("*.json"):
+            upload_id = meta.stem
+            part = self._part(upload_id)
+            mtime = part.stat().st_mtime if part.exists() else meta.stat().st_mtime
+            if mtime >= cutoff:
+                continue
+            with self._lock:
+                sess = self._sessions.get(upload_id)
+            if sess is not None and sess.lock.locked():  # 正在接收資料
+                continue
+            self.discard(upload_id)
+            removed += 1
+        return removed
+
+    def discard(self, upload_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+        self._part(upload_id).unlink(missing_ok=True)
+        self._meta(upload_id).unlink(missing_ok=True)
+
+
+_manager: UploadManager | None = None
+
+
+def get_uploads() -> UploadManager:
+    global _manager
+    if _manager is None:
+        from ..core.config import settings
+
+        _manager = UploadManager(settings.storage_dir / "uploads")
+    return _manager
@@ -0,0 +1,42 @@
+"""TokenBudget：截斷的輸出要把比例往上修，並依階梯調高預算重試。"""
+from __future__ import annotations
+
+from backend.app.services.budget import TokenBudget
+from backend.app.services.llm import ChatResult
+
+
+def test_truncated_sample_raises_ratio():
+    budget = TokenBudget()
+    before = budget.max_tokens("summary", "en", 1000)
+    budget.observe("summary", "en", 1000, ChatResult("x", 0.1, before, truncated=True), before)
+    assert budget.ratio("summary", "en") >= before / 1000
+    assert budget.max_tokens("summary", "en", 1000) >= before
+
+
+def test_generate_retries_truncated_call_at_next_step():
+    budget = TokenBudget()
+    asked: list[int] = []
+    streamed: list[object] = []
+
+    def chat(n, on_delta):
+        asked.append(n)
+        streamed.append(on_delta)
+        return ChatResult("x", 0.1, n, truncated=len(asked) < 3)
+
+    res = budget.generate("translate", "en", 100, chat, on_delta=print)
+    assert not res.truncated
+    assert asked == sorted(set(asked)) and len(asked) == 3
+    assert streamed[0] is print and streamed[1:] == [None, None]
+
+
+def test_generate_stops_at_task_cap():
+    budget = TokenBudget()
+    asked: list[int] = []
+
+    def chat(n, on_delta):
+        asked.append(n)
+        return ChatResult("x", 0.1, n, truncated=True)
+
+    res = budget.generate("summary", "en", 5000, chat)
+    assert res.truncated and asked[-1] == 900
+    assert len(asked) == len(set(asked))
@@ -0,0 +1,83 @@
+"""儲存回收：結果快取 LRU、blob 回收寬限、LLM/頁面快取上限、上傳檔修改時間。"""
+from __future__ import annotations
+
+import os
+import time
+
+from backend.app.services.blobs import BlobStore
+from backend.app.services.cache import ChatCache, PageCache, ResultCache
+from backend.app.services.uploads import store_stream
+
+
+def _result(n: int) -> dict:
+    return {"segments": [{"index": 0, "original": "x" * n}], "n": n}
+
+
+def test_result_cache_evicts_strictly_by_recency(tmp_path):
+    blobs = BlobStore(tmp_path / "results.db")
+    cache = ResultCache(tmp_path / "cache.db", blobs)
+    for key, n in (("old-small", 1), ("mid-big", 4000), ("new", 10)):
+        cache.put(key, _result(n))
+        time.sleep(0.01)
+    sizes = {k: s for k, s in cache._conn().execute("SELECT key, size FROM result_cache")}
+    # 上限放得下 new + old-small，但放不下 mid-big：mid-big 之後更舊的也要一併淘汰
+    assert cache.evict(max_bytes=sizes["new"] + sizes["old-small"]) == 2
+    assert cache.refs() == {cache.ref("new")}
+    assert cache.stats()["evictions"] == 2
+
+
+def test_lookup_refreshes_recency(tmp_path):
+    cache = ResultCache(tmp_path / "cache.db", BlobStore(tmp_path / "results.db"))
+    cache.put("a", _result(1))
+    time.sleep(0.01)
+    cache.put("b", _result(2))
+    time.sleep(0.01)
+    assert cache.lookup("a") is not None
+    cache.evict(max_entries=1)
+    assert cache.ref("a") and not cache.ref("b")
+
+
+def test_lookup_meta_skips_segments_but_counts_hit(tmp_path):
+    cache = ResultCache(tmp_path / "cache.db", BlobStore(tmp_path / "results.db"))
+    cache.put("a", {**_result(3), "total_pages": 7})
+    ref, meta = cache.lookup_meta("a")
+    assert ref == cache.ref("a")
+    assert meta["total_pages"] == 7 and meta["segment_count"] == 1 and "segments" not in meta
+    assert cache.lookup_meta("missing") is None
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+
+def test_reput_protects_blob_from_prune(tmp_path):
+    blobs = BlobStore(tmp_path / "results.db")
+    digest = blobs.put(_result(5))
+    blobs._conn().execute("UPDATE blobs SET created_at=0")
+    assert blobs.put(_result(5)) == digest        # 重新被引用
+    assert blobs.prune(keep=set(), older_than=time.time() - 60) == 0
+    assert blobs.get(digest) is not None
+
+
+def test_chat_and_page_caches_are_bounded(tmp_path):
+    chat = ChatCache(tmp_path / "llm_cache.db")
+    for i in range(5):
+        chat.put(f"k{i}", "t", 1)
+    chat._conn().execute("UPDATE chat_cache SET created_at=0 WHERE key='k0'")
+    assert chat.evict(max_entries=3, ttl=3600) == 2     # k0 過期 + 最舊的 k1
+    assert chat.get("k0") is None and chat.get("k1") is None and chat.get("k4")
+
+    pages = PageCache(tmp_path / "pages.db")
+    pages.put_pages("d", "text", {0: "a", 1: "b"})
+    pages.put_ocr("img", "ocr")
+    pages._conn().execute("UPDATE page_text SET created_at=0")
+    pages._conn().execute("UPDATE ocr_text SET created_at=0")
+    assert pages.evict(ttl=3600) == 3
+    assert pages.get_pages("d", "text") == {} and pages.get_ocr("img") is None
+
+
+def test_reupload_refreshes_existing_file_mtime(tmp_path):
+    chunks = iter([b"%PDF-1.4 same", b""])
+    digest, path = store_stream(lambda n: next(chunks), tmp_path, 1 << 20)
+    os.utime(path, (0, 0))
+    chunks = iter([b"%PDF-1.4 same", b""])
+    assert store_stream(lambda n: next(chunks), tmp_path, 1 << 20) == (digest, path)
+    assert path.stat().st_mtime > time.time() - 60
+    assert list(tmp_path.glob("*.part")) == []
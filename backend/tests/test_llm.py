@@ -0,0 +1,137 @@
+"""LLMClient 送往 llama-server 的擴充參數（以 httpx.MockTransport 充當 stub server）。"""
+from __future__ import annotations
+
+import json
+
+import httpx
+
+from backend.app.services.llm import LLMClient
+
+
+def _stub(seen: list[dict]) -> httpx.Client:
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        seen.append(body)
+        if body.get("stream"):
+            sse = (
+                'data: {"choices":[{"delta":{"content":"好"}}]}\n\n'
+                'data: {"choices":[],"usage":{"completion_tokens":1}}\n\n'
+                "data: [DONE]\n\n"
+            )
+            return httpx.Response(200, text=sse, headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "好"}}],
+            "usage": {"completion_tokens": 1},
+        })
+
+    return httpx.Client(transport=httpx.MockTransport(handler))
+
+
+def test_cache_prompt_sent_without_slot():
+    seen: list[dict] = []
+    llm = LLMClient("http://stub/v1", "m", client=_stub(seen), repeat_guard=False)
+    assert llm.chat("sys", "hi", max_tokens=16).text == "好"
+    assert seen[0]["cache_prompt"] is True
+    assert "id_slot" not in seen[0]
+
+
+def test_cache_prompt_can_be_disabled():
+    seen: list[dict] = []
+    llm = LLMClient("http://stub/v1", "m", client=_stub(seen), cache_prompt=False,
+                    repeat_guard=False)
+    llm.chat("sys", "hi", max_tokens=16)
+    assert seen[0]["cache_prompt"] is False
+
+
+def test_pinned_rotates_over_slots():
+    seen: list[dict] = []
+    llm = LLMClient("http://stub/v1", "m", client=_stub(seen), repeat_guard=False)
+    pinned = llm.pinned([1, 3])
+    for _ in range(4):
+        pinned.chat("sys", "hi", max_tokens=16)
+    assert [b["id_slot"] for b in seen] == [1, 3, 1, 3]
+    assert all(b["cache_prompt"] for b in seen)
+    llm.chat("sys", "hi", max_tokens=16)   # 原本的 client 不受影響
+    assert "id_slot" not in seen[-1]
+
+
+def test_streaming_request_carries_slot_and_cache_prompt():
+    seen: list[dict] = []
+    llm = LLMClient("http://stub/v1", "m", client=_stub(seen)).pinned([2])
+    got: list[str] = []
+    res = llm.chat("sys", "hi", max_tokens=16, on_delta=got.append)
+    assert res.text == "好" and got == ["好"]
+    assert seen[0]["stream"] is True
+    assert seen[0]["id_slot"] == 2 and seen[0]["cache_prompt"] is True
+
+
+class _MemCache:
+    """ChatCache 的記憶體替身。"""
+
+    def __init__(self):
+        self.rows: dict[str, tuple[str, int]] = {}
+
+    make_key = staticmethod(lambda *parts: json.dumps(parts))
+
+    def get(self, key):
+        return self.rows.get(key)
+
+    def put(self, key, text, tokens):
+        self.rows[key] = (text, tokens)
+
+
+def _finishing(reason: str, tokens: int) -> httpx.Client:
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "截斷"}, "finish_reason": reason}],
+            "usage": {"completion_tokens": tokens},
+        })
+
+    return httpx.Client(transport=httpx.MockTransport(handler))
+
+
+def test_truncated_result_is_flagged_and_not_cached():
+    cache = _MemCache()
+    llm = LLMClient("http://stub/v1", "m", client=_finishing("length", 16), cache=cache,
+                    repeat_guard=False)
+    res = llm.chat("sys", "hi", max_tokens=16)
+    assert res.truncated
+    assert cache.rows == {}
+
+
+def test_cached_entry_that_filled_the_budget_is_a_miss():
+    cache = _MemCache()
+    llm = LLMClient("http://stub/v1", "m", client=_finishing("stop", 3), cache=cache,
+                    repeat_guard=False)
+    cache.put(cache.make_key("m", "sys", "hi", 16, 0.3), "舊的截斷結果", 16)
+    res = llm.chat("sys", "hi", max_tokens=16)
+    assert not res.cached and res.text == "截斷"
+
+
+def test_background_stream_fails_over_after_first_token():
+    calls: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.host)
+        if request.url.host == "bad":
+            def broken():
+                yield b'data: {"choices":[{"delta":{"content":"a"}}]}\n\n'
+                raise httpx.ReadError("reset", request=request)
+
+            return httpx.Response(200, stream=_Iter(broken()))
+        sse = 'data: {"choices":[{"delta":{"content":"ok"},"finish_reason":"stop"}]}\n\ndata: [DONE]\n\n'
+        return httpx.Response(200, text=sse)
+
+    llm = LLMClient("http://bad/v1,http://good/v1", "m",
+                    client=httpx.Client(transport=httpx.MockTransport(handler)))
+    res = llm.chat("sys", "hi", max_tokens=16)   # repeat_guard 預設開啟 → 走串流、沒有 on_delta
+    assert res.text == "ok"
+    assert calls == ["bad", "good"]
+
+
+class _Iter(httpx.SyncByteStream):
+    def __init__(self, it):
+        self.it = it
+
+    def __iter__(self):
+        yield from self.it
@@ -0,0 +1,99 @@
+"""pipeline：語言判定以全文為準（不只看第一段），翻譯與否逐段決定。"""
+from __future__ import annotations
+
+import fitz
+import pytest
+
+from backend.app.core.config import Settings
+from backend.app.services import pipeline
+from backend.app.services.pipeline import run_pipeline
+from backend.app.services.translate import TranslateResult
+
+
+@pytest.fixture
+def mixed_pdf(tmp_path):
+    doc = fitz.open()
+    page = doc.new_page()
+    for k in range(12):   # 中文摘要頁
+        page.insert_text((40, 60 + 20 * k), "本研究提出一種新的文件摘要方法，並評估其效果與限制。",
+                         fontname="china-t", fontsize=11)
+    for n in range(4):    # 英文本文
+        page = doc.new_page()
+        for k in range(30):
+            page.insert_text((40, 40 + 18 * k),
+                             f"Section {n} line {k}: the encoder compresses visual tokens efficiently.",
+                             fontsize=10)
+    path = tmp_path / "mixed.pdf"
+    doc.save(path)
+    return path
+
+
+def test_language_is_detected_over_whole_document(mixed_pdf, tmp_path, monkeypatch):
+    monkeypatch.setenv("DISABLE_OPENCC", "1")
+    monkeypatch.setenv("DISABLE_LLM_CACHE", "1")   # 不在工作目錄建立 storage/llm_cache.db
+    settings = Settings(max_chunk_tokens=200, extract_workers=1, storage_dir=tmp_path)
+    events = list(run_pipeline(mixed_pdf, settings, do_summary=False, do_translate=False,
+                               do_wordcloud=False, do_report=False))
+    result = events[-1]
+    assert result["type"] == "result", result
+    assert result["data"]["segments"][0]["original"].startswith("本研究")
+    assert result["data"]["language"] == "en"
+
+
+class _EchoTranslator:
+    def __init__(self, src: str):
+        self.src = src
+        self.seen: list[str] = []
+
+    def translate(self, text, on_delta=None):
+        self.seen.append(text)
+        return TranslateResult(f"[{self.src}] 譯文", 0.0)
+
+
+def _run_translating(pdf, tmp_path, monkeypatch) -> tuple[list[dict], dict[str, _EchoTranslator]]:
+    monkeypatch.setenv("DISABLE_OPENCC", "1")
+    monkeypatch.setenv("DISABLE_LLM_CACHE", "1")
+    built: dict[str, _EchoTranslator] = {}
+
+    def fake_build(settings, llm, src_iso=None):
+        return built.setdefault(src_iso, _EchoTranslator(src_iso))
+
+    monkeypatch.setattr(pipeline, "build_translator", fake_build)
+    settings = Settings(max_chunk_tokens=200, extract_workers=1, storage_dir=tmp_path,
+                        translator="qwen", target_lang="zho_Hant")
+    events = list(run_pipeline(pdf, settings, do_summary=False, do_translate=True,
+                               do_wordcloud=False, do_report=False))
+    assert events[-1]["type"] == "result", events[-1]
+    return events[-1]["data"]["segments"], built
+
+
+def test_translation_decided_per_chunk(mixed_pdf, tmp_path, monkeypatch):
+    segments, built = _run_translating(mixed_pdf, tmp_path, monkeypatch)
+    zh = [seg for seg in segments if seg["original"].startswith("本研究")]
+    en = [seg for seg in segments if seg["original"].startswith("Section")]
+    assert zh and en and len(zh) + len(en) == len(segments)
+    assert all("translated" not in seg for seg in zh)
+    assert all(seg["translated"] == "[en] 譯文" for seg in en)
+    assert set(built) == {"en"}
+
+
+def test_chinese_body_after_english_first_page_is_not_translated(tmp_path, monkeypatch):
+    doc = fitz.open()
+    page = doc.new_page()
+    for k in range(30):
+        page.insert_text((40, 40 + 18 * k), f"Cover line {k}: annual report of the institute.",
+                         fontsize=10)
+    for _ in range(3):
+        page = doc.new_page()
+        for k in range(25):
+            page.insert_text((40, 40 + 20 * k), "本章說明研究方法與實驗設計，並討論主要結果。",
+                             fontname="china-t", fontsize=11)
+    path = tmp_path / "zh.pdf"
+    doc.save(path)
+    segments, built = _run_translating(path, tmp_path, monkeypatch)
+    zh = [seg for seg in segments if seg["original"].startswith("本章")]
+    en = [seg for seg in segments if seg["original"].startswith("Cover")]
+    assert zh and en and len(zh) + len(en) == len(segments)
+    assert all(seg["translated"] == "[en] 譯文" for seg in en)
+    assert all("translated" not in seg for seg in zh)
+    assert set(built) == {"en"}
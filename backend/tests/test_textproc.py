@@ -0,0 +1,67 @@
+"""逐頁擷取快取：空白頁也要命中，OCR 失敗的頁不寫入。"""
+from __future__ import annotations
+
+import fitz
+import pytest
+
+from backend.app.services import ocr, textproc
+from backend.app.services.cache import PageCache
+
+
+@pytest.fixture
+def pdf_with_blank(tmp_path):
+    doc = fitz.open()
+    for n in range(3):
+        page = doc.new_page()
+        if n != 1:   # 第二頁留白
+            page.insert_text((40, 60), f"page {n} has some text on it", fontsize=11)
+    path = tmp_path / "blank.pdf"
+    doc.save(path)
+    return path
+
+
+def _no_extraction(*args, **kwargs):
+    raise AssertionError("應該整個範圍命中快取")
+
+
+def test_blank_page_does_not_defeat_page_cache(pdf_with_blank, tmp_path, monkeypatch):
+    cache = PageCache(tmp_path / "pages.db")
+    first = list(textproc.iter_pages(pdf_with_blank, ocr=False, digest="d", cache=cache))
+    assert first[1] == ""
+    monkeypatch.setattr(textproc, "_iter_range", _no_extraction)
+    assert list(textproc.iter_pages(pdf_with_blank, ocr=False, digest="d", cache=cache)) == first
+
+
+def test_ocr_failure_is_not_cached(pdf_with_blank, tmp_path, monkeypatch):
+    cache = PageCache(tmp_path / "pages.db")
+    monkeypatch.setattr(ocr, "ocr_png", lambda png: None)
+    texts = list(textproc.iter_pages(pdf_with_blank, ocr=True, ocr_min_chars=5,
+                                     digest="d", cache=cache))
+    assert texts[1] == ""
+    assert sorted(cache.get_pages("d", "ocr:5:200")) == [0, 2]
+
+    monkeypatch.setattr(ocr, "ocr_png", lambda png: "")   # OCR 成功但確實沒有文字
+    list(textproc.iter_pages(pdf_with_blank, ocr=True, ocr_min_chars=5, digest="d", cache=cache))
+    assert cache.get_pages("d", "ocr:5:200")[1] == ""
+
+
+def test_server_count_called_once_per_page():
+    calls: list[str] = []
+
+    def count(text: str) -> int:   # 模擬 /tokenize：比估算多 20%
+        calls.append(text)
+        return int(textproc.estimate_tokens(text) * 1.2)
+
+    long_page = "\n".join(f"Sentence {k} about encoders. Another one follows here." for k in range(200))
+    pages = ["short page", long_page, "another short page"]
+    chunks = list(textproc.iter_chunks(iter(pages), 300, count))
+    assert len(calls) == len(pages)
+    assert len(chunks) > 1
+    assert all(count(c) <= 300 for c in chunks)
+
+
+def test_separators_count_toward_chunk_budget():
+    pages = [f"p{k} ab cd" for k in range(120)]   # 大量小頁：分隔符累積起來不可忽略
+    for chunks in (textproc.chunk_by_tokens(pages, 40), list(textproc.iter_chunks(iter(pages), 40))):
+        assert len(chunks) > 1
+        assert all(textproc.estimate_tokens(c) <= 40 for c in chunks)
@@ -0,0 +1,43 @@
+"""QwenTranslator / Summarizer：窗口與批次共用各自的執行緒池，不逐次新建。"""
+from __future__ import annotations
+
+import threading
+
+from backend.app.services.llm import ChatResult
+from backend.app.services.summarize import Summarizer
+from backend.app.services.translate import QwenTranslator
+
+
+class _RecordingLLM:
+    def __init__(self):
+        self.threads: set[str] = set()
+        self._lock = threading.Lock()
+
+    def chat(self, system, user, max_tokens=None, temperature=0.2, on_delta=None):
+        with self._lock:
+            self.threads.add(threading.current_thread().name)
+        return ChatResult("譯文", 0.0, 1)
+
+
+def test_translator_reuses_one_pool_across_chunks():
+    llm = _RecordingLLM()
+    tr = QwenTranslator(llm, window_chars=40, concurrency=2)
+    text = " ".join(f"Sentence number {k} is here." for k in range(12))
+    try:
+        for _ in range(5):
+            assert len(tr.translate(text).window_elapsed) > 2
+    finally:
+        tr.close()
+    assert llm.threads and all(t.startswith("translate") for t in llm.threads)
+    assert len(llm.threads) <= 2
+
+
+def test_summarizer_condenses_on_its_own_pool():
+    llm = _RecordingLLM()
+    s = Summarizer(llm, global_input_chars=50, concurrency=3)
+    try:
+        s.summarize_global(["重點" * 20] * 6)
+    finally:
+        s.close()
+    workers = {t for t in llm.threads if t.startswith("summarize")}
+    assert 1 <= len(workers) <= 3
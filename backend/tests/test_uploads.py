@@ -0,0 +1,57 @@
+"""可續傳上傳：Content-Range 長度檢查與重啟後的工作階段重建。"""
+from __future__ import annotations
+
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.app.main import app
+from backend.app.services import uploads
+from backend.app.services.uploads import UploadManager
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "_manager", UploadManager(tmp_path / "uploads"))
+    return TestClient(app)
+
+
+def _create(client, size: int) -> str:
+    r = client.post("/uploads", json={"filename": "a.pdf", "size": size})
+    assert r.status_code == 200
+    return r.json()["upload_id"]
+
+
+def test_put_in_two_parts(client):
+    data = b"%PDF" + bytes(range(256)) * 4
+    uid = _create(client, len(data))
+    r = client.put(f"/uploads/{uid}", content=data[:100],
+                   headers={"Content-Range": f"bytes 0-99/{len(data)}"})
+    assert r.json()["offset"] == 100
+    r = client.put(f"/uploads/{uid}", content=data[100:],
+                   headers={"Content-Range": f"bytes 100-{len(data) - 1}/{len(data)}"})
+    assert r.json()["offset"] == len(data)
+    sess = uploads.get_uploads().get(uid)
+    assert sess.hasher.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+@pytest.mark.parametrize("body", [b"x" * 50, b"x" * 150])
+def test_body_not_matching_range_is_rejected_and_rolled_back(client, body):
+    uid = _create(client, 200)
+    r = client.put(f"/uploads/{uid}", content=body, headers={"Content-Range": "bytes 0-99/200"})
+    assert r.status_code == 400
+    assert client.get(f"/uploads/{uid}").json()["offset"] == 0
+    assert (uploads.get_uploads().session_dir / f"{uid}.part").stat().st_size == 0
+    r = client.put(f"/uploads/{uid}", content=b"y" * 100, headers={"Content-Range": "bytes 0-99/200"})
+    assert r.json()["offset"] == 100
+
+
+def test_session_rebuilt_after_restart(tmp_path):
+    first = UploadManager(tmp_path)
+    sess = first.create("a.pdf", 10)
+    with first.append(sess, 0, 4) as write:
+        write(b"abcd")
+    again = UploadManager(tmp_path).get(sess.upload_id)
+    assert again.offset == 4
+    assert again.hasher.hexdigest() == hashlib.sha256(b"abcd").hexdigest()
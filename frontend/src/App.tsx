@@ -1,6 +1,6 @@
 import { useEffect, useState } from "react";
 import "./App.css";
-import { analyzeStream, getResult, type AnalyzeResult } from "./lib/api";
+import { analyzeStream, getResultPaged, type AnalyzeResult } from "./lib/api";
 import { t, type Lang } from "./lib/i18n";
 import { AlertIcon, FileIcon, HistoryIcon, MoonIcon, SunIcon } from "./components/icons";
 import UploadZone from "./components/UploadZone";
@@ -53,7 +53,7 @@ export default function App() {
           setProgress(e.progress);
           setMessage(e.message);
           if (e.type === "result" && e.data) {
-            setResult(e.data);
+            setResult(e.data as AnalyzeResult);
             setPhase("done");
           } else if (e.type === "error") {
             setError(e.message);
@@ -87,7 +87,7 @@ export default function App() {
     setMessage(tr.loading);
     setProgress(100);
     try {
-      const r = await getResult(docId);
+      const r = await getResultPaged(docId);
       setResult(r);
       setFromHistory(true);
       setPhase("done");
@@ -151,6 +151,7 @@ export default function App() {
         {screen === "analyze" && phase === "done" && result && (
           <div className="reading">
             <Results
+              key={result.doc_id}
               t={tr}
               result={result}
               onReset={reset}
@@ -1,5 +1,5 @@
 import { useState } from "react";
-import { reportUrl, type AnalyzeResult, type Segment } from "../lib/api";
+import { getSegments, reportUrl, SEGMENT_PAGE, type AnalyzeResult, type Segment } from "../lib/api";
 import type { Dict } from "../lib/i18n";
 import { DownloadIcon } from "./icons";
 
@@ -22,12 +22,26 @@ export default function Results({ t, result, onReset, onReanalyze }: Props) {
       ]
     : [];
   const hasQuads = quads.some(([, v]) => v);
+  // 從歷史或快取命中開啟時只帶第一頁段落，其餘按需分頁載入
+  const [segments, setSegments] = useState<Segment[]>(result.segments);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const total = result.segment_count ?? result.segments.length;
+
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const page = await getSegments(result.doc_id, segments.length, SEGMENT_PAGE);
+      setSegments((prev) => [...prev, ...(page.segments as Segment[])]);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   return (
     <div>
       <div className="res-bar">
         <div className="res-meta">
-          <b>{result.total_pages}</b> {t.pages} · <b>{result.segments.length}</b> {t.seg}
+          <b>{result.total_pages}</b> {t.pages} · <b>{total}</b> {t.seg}
         </div>
         {pdf && (
           <a className="btn-accent" href={pdf} target="_blank" rel="noreferrer">
@@ -79,9 +93,14 @@ export default function Results({ t, result, onReset, onReanalyze }: Props) {
       )}
 
       <h2 className="section-h">{t.segments}</h2>
-      {result.segments.map((s) => (
+      {segments.map((s) => (
         <SegmentCard key={s.index} t={t} seg={s} />
       ))}
+      {segments.length < total && (
+        <button className="pill-btn" type="button" onClick={loadMore} disabled={loadingMore}>
+          {loadingMore ? t.loading : t.loadMore}
+        </button>
+      )}
     </div>
   );
 }
@@ -25,16 +25,50 @@ export interface AnalyzeResult {
   keywords: string[];
   wordcloud_image_url?: string | null;
   report_pdf_url?: string | null;
+  /** 段落總數；只載入了第一頁段落時（getResultPaged）才有，其餘由 getSegments 補。 */
+  segment_count?: number;
+}
+
+export interface SegmentDelta {
+  index: number;
+  field: "summary" | "translated";
+  text: string;
 }
 
 export interface StreamEvent {
-  type: "progress" | "result" | "error";
+  type: "progress" | "result" | "error" | "delta";
   progress: number;
   message: string;
-  data?: AnalyzeResult | null;
+  data?: AnalyzeResult | SegmentDelta | null;
+}
+
+async function sha256Hex(file: File): Promise<string | null> {
+  // crypto.subtle 只在安全來源（https / localhost）可用；不可用時直接上傳
+  if (!globalThis.crypto?.subtle) return null;
+  const buf = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+  return Array.from(new Uint8Array(buf), (b) => b.toString(16).padStart(2, "0")).join("");
+}
+
+/** 先送 hash：伺服器已有同內容同功能的結果時回 doc_id，免上傳。 */
+export async function lookupDocument(
+  file: File,
+  features: string[],
+  signal?: AbortSignal,
+): Promise<string | null> {
+  const sha256 = await sha256Hex(file);
+  if (!sha256) return null;
+  const res = await fetch(`${BACKEND}/documents/lookup`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ sha256, filename: file.name, features: features.join(",") }),
+    signal,
+  });
+  if (!res.ok) return null;
+  const body = (await res.json()) as { doc_id?: string | null };
+  return body.doc_id ?? null;
 }
 
-/** 上傳 PDF 並以 NDJSON 串流回報進度；逐事件 callback。 */
+/** 上傳 PDF 並以 NDJSON 串流回報進度；逐事件 callback。已分析過的內容直接取回結果、不上傳。 */
 export async function analyzeStream(
   file: File,
   features: string[],
@@ -42,6 +76,14 @@ export async function analyzeStream(
   refresh = false,
   signal?: AbortSignal,
 ): Promise<void> {
+  if (!refresh) {
+    const docId = await lookupDocument(file, features, signal).catch(() => null);
+    if (docId) {
+      onEvent({ type: "result", progress: 100, message: "快取命中", data: await getResultPaged(docId) });
+      return;
+    }
+  }
+
   const fd = new FormData();
   fd.append("file", file);
   fd.append("features", features.join(","));
@@ -92,12 +134,43 @@ export async function listDocuments(): Promise<DocumentSummary[]> {
   return res.json();
 }
 
-export async function getResult(docId: string): Promise<AnalyzeResult> {
-  const res = await fetch(`${BACKEND}/documents/${docId}/result`);
+export type ResultMeta = Omit<AnalyzeResult, "segments"> & { segment_count: number };
+
+export const SEGMENT_PAGE = 20;
+
+export interface SegmentPage {
+  doc_id: string;
+  total: number;
+  offset: number;
+  segments: Partial<Segment>[];
+}
+
+/** 結果頂層欄位（不含段落內容）。 */
+export async function getMeta(docId: string): Promise<ResultMeta> {
+  const res = await fetch(`${BACKEND}/documents/${docId}/meta`);
   if (!res.ok) throw new Error(`HTTP ${res.status}`);
   return res.json();
 }
 
+/** 分頁取段落；fields 只取需要的欄位（例如只看摘要）。 */
+export async function getSegments(
+  docId: string,
+  offset = 0,
+  limit = SEGMENT_PAGE,
+  fields: (keyof Omit<Segment, "index">)[] = ["original", "summary", "translated"],
+): Promise<SegmentPage> {
+  const q = new URLSearchParams({ offset: String(offset), limit: String(limit), fields: fields.join(",") });
+  const res = await fetch(`${BACKEND}/documents/${docId}/segments?${q}`);
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  return res.json();
+}
+
+/** 已存結果：頂層欄位 + 第一頁段落，其餘段落按「載入更多」時再以 getSegments 分頁取。 */
+export async function getResultPaged(docId: string): Promise<AnalyzeResult> {
+  const [meta, page] = await Promise.all([getMeta(docId), getSegments(docId)]);
+  return { ...meta, segments: page.segments as Segment[] };
+}
+
 export async function deleteDocument(docId: string): Promise<void> {
   const res = await fetch(`${BACKEND}/documents/${docId}`, { method: "DELETE" });
   if (!res.ok) throw new Error(`HTTP ${res.status}`);
@@ -44,6 +44,7 @@ const dict = {
     stProcessing: "分析中",
     stError: "失敗",
     loading: "載入中…",
+    loadMore: "載入更多段落",
   },
   en: {
     title: "AutoNote",
@@ -88,6 +89,7 @@ const dict = {
     stProcessing: "Processing",
     stError: "Failed",
     loading: "Loading…",
+    loadMore: "Load more segments",
   },
 } as const;
 